@@ -1,26 +1,157 @@
+from typing import List, Tuple
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     # Telegram Bot
     bot_token: str
+    auth_legacy_variants: bool = False  # старые варианты проверки initData (дороже на неудачных логинах)
+    auth_cache_size: int = 10000  # недавно проверенные initData
+    auth_cache_ttl: float = 3600.0
+    session_secret: str = ""  # ключ подписи токенов сессии (пусто - выводится из bot_token)
+    session_ttl: int = 6 * 3600
+    user_upsert_interval: float = 3600.0  # профиль без изменений переписываем не чаще этого
+    user_upsert_cache_size: int = 100000
     
     # VK API
     vk_token: str
     vk_user_agent: str
+    # Несколько аккаунтов VK через запятую (если пусто - только vk_token).
+    # User-Agent'ы сопоставляются токенам по порядку, по кругу.
+    vk_tokens: str = ""
+    vk_user_agents: str = ""
+    vk_account_strategy: str = "least_loaded"  # или round_robin
+    vk_account_auth_cooldown: float = 900.0  # аккаунт с ошибкой авторизации выключается на это время
+    vk_account_rate_cooldown: float = 300.0  # ... а упершийся во флуд-контроль - на это
+    vk_api_url: str = "https://api.vk.com/method"
+    vk_api_version: str = "5.131"
+    vk_fallback_vkpymusic: bool = True  # при ошибке audio.getById идем через vkpymusic
+    vk_batch_window_ms: float = 5.0  # окно склейки getById в один вызов
+    vk_batch_max_ids: int = 100
+
+    # VK rate limiting (лимит VK - около 3 запросов в секунду на токен, бюджет у каждого токена свой)
+    vk_rate_limit: float = 3.0
+    vk_rate_burst: int = 3
+    vk_queue_size: int = 200  # сколько запросов может ждать бюджет, остальные получают отказ
+    vk_rate_limit_dir: str = ""  # где хранить общее для воркеров состояние (по умолчанию - temp)
+    vk_breaker_threshold: int = 5  # ошибок подряд до размыкания
+    vk_breaker_reset: float = 30.0  # секунд до пробного запроса
+
+    # HTTP client (общий пул соединений)
+    http_pool_limit: int = 100
+    http_pool_limit_per_host: int = 30
+    http_keepalive_timeout: float = 30.0
+    http_dns_cache_ttl: int = 300
+    http_connect_timeout: float = 5.0
+    http_read_timeout: float = 10.0
+    http_total_timeout: float = 15.0
     
+    # Search cache
+    search_cache_size: int = 2048
+    search_cache_ttl: float = 600.0
+    search_cache_empty_ttl: float = 60.0  # пустая выдача живет меньше: трек могли только что залить
+    search_cache_stale_ttl: float = 3600.0  # сколько отдавать устаревшее, пока VK недоступен
+    search_cache_swr_ttl: float = 300.0  # недавно протухшее отдаем сразу и обновляем в фоне
+
+    # Prefetch of popular queries
+    prefetch_enabled: bool = True
+    prefetch_interval: float = 30.0
+    prefetch_top_k: int = 100
+    prefetch_margin: float = 60.0  # обновляем записи, которым осталось жить меньше интервала + запас
+    prefetch_concurrency: int = 4
+    search_cache_shared: bool = False  # устарело: то же, что cache_shared_backend=mongo, только для поиска
+
+    # Shared cache tier (поиск и ссылки на аудио) для всех воркеров и хостов
+    cache_shared_backend: str = ""  # пусто - только in-process LRU; mongo или redis
+    redis_url: str = "redis://localhost:6379/0"
+    cache_key_prefix: str = "vkmusic:"
+
+    # Search pagination
+    search_max_results: int = 1000  # глубже по offset VK поиск не отдает
+    search_prefetch_next: bool = False  # греть соседние страницы, пока смотрят текущую (тратит бюджет VK)
+    search_stream_max_pages: int = 5  # сколько страниц максимум в NDJSON-потоке
+
+    # Suggest index (подсказки без запросов в VK)
+    suggest_max_tracks: int = 50000  # ограничение памяти индекса
+    suggest_min_score: float = 0.4  # доля совпавших триграмм запроса
+    suggest_max_candidates: int = 1000  # сколько треков максимум проверяем на запрос
+    suggest_snapshot_path: str = ".cache/suggest.json"  # пусто - без снимка на диске
+    suggest_snapshot_interval: float = 300.0
+
+    # Audio URL cache
+    audio_url_cache_size: int = 10000
+    audio_url_cache_ttl: float = 1800.0  # если в ссылке нет параметра expires
+    audio_url_expiry_margin: float = 60.0  # выбрасываем ссылку заранее, до её expires
+
+    # Recommendations
+    rec_max_profiles: int = 10000  # профилей пользователей в памяти (LRU)
+    rec_profile_ttl: float = 300.0  # после этого профиль перечитывается из истории в фоне
+    rec_history_window: int = 200  # сколько последних прослушиваний читаем для профиля
+    rec_half_life_days: float = 14.0  # период полураспада веса прослушивания
+    rec_catalog_size: int = 100000  # треков-кандидатов в памяти
+
+    # /download proxy mode
+    download_proxy: bool = False  # стримить аудио через сервер вместо редиректа
+    proxy_max_streams: int = 64
+    proxy_chunk_size: int = 65536
+
+    # On-disk audio cache for hot tracks
+    audio_cache_enabled: bool = False
+    audio_cache_dir: str = ".cache/audio"
+    audio_cache_max_bytes: int = 2 * 1024 ** 3
+    audio_cache_hot_threshold: int = 3  # столько прослушиваний в окне - и трек скачивается
+    audio_cache_hot_window: float = 3600.0
+    audio_cache_workers: int = 2
+    audio_cache_segment_concurrency: int = 8
+
+    # Cover thumbnails (/api/music/cover)
+    cover_cache_dir: str = ".cache/covers"
+    cover_cache_max_bytes: int = 256 * 1024 ** 2
+    cover_sizes: str = "96,300,600"  # размеры превью через запятую
+    cover_quality: int = 80
+    cover_workers: int = 2  # процессы для ресайза
+    cover_max_age: int = 30 * 24 * 3600  # Cache-Control для клиентов
+    cover_url_cache_size: int = 50000
+    cover_url_cache_ttl: float = 86400.0
+
+    # Conditional & compressed responses (search, recommendations)
+    response_cache_size: int = 1000  # готовые тела ответов для горячих запросов
+    response_compress_min_bytes: int = 1024  # меньше - сжатие не окупается
+    response_gzip_level: int = 6
+    response_brotli_quality: int = 5  # brotli - опционально, если пакет установлен
+
     # MongoDB
     mongo_url: str
     db_name: str
+    history_ttl_days: float = 0  # 0 - хранить историю бессрочно
+
+    # History write-behind buffer
+    history_batch_size: int = 500
+    history_flush_interval: float = 1.0  # секунды: максимальный возраст события в буфере
+    history_max_pending: int = 10000  # при переполнении /history ждет (backpressure)
+    history_import_max_items: int = 500  # максимум событий в одном запросе /history/batch
+    history_summary_top_artists: int = 10
     
     # Application
     app_host: str = "0.0.0.0"
     app_port: int = 8000
     debug: bool = False
 
+    # Logging & metrics
+    log_level: str = "INFO"
+    log_format: str = "json"  # или text
+    log_sample_rate: float = 1.0  # доля частых INFO-сообщений (поиск, логины), которые пишем
+    metrics_dir: str = ""  # общий каталог для метрик нескольких воркеров (пусто - только свой процесс)
+    metrics_flush_interval: float = 5.0
+
     # SSL
     ssl_keyfile: str = None
     ssl_certfile: str = None
 
+    def vk_accounts(self) -> List[Tuple[str, str]]:
+        tokens = [t.strip() for t in self.vk_tokens.split(",") if t.strip()] or [self.vk_token]
+        user_agents = [u.strip() for u in self.vk_user_agents.split(",") if u.strip()] or [self.vk_user_agent]
+        return [(token, user_agents[i % len(user_agents)]) for i, token in enumerate(tokens)]
+
     class Config:
         env_file = ".env"
         case_sensitive = False
@@ -1,5 +1,12 @@
+import logging
+import time
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
 from app.core.config import settings
+from app.core.metrics import MongoCommandListener
+
+logger = logging.getLogger(__name__)
 
 class Database:
     client: AsyncIOMotorClient = None
@@ -8,10 +15,57 @@ class Database:
 db = Database()
 
 async def connect_to_mongo():
-    db.client = AsyncIOMotorClient(settings.mongo_url)
+    db.client = AsyncIOMotorClient(settings.mongo_url, event_listeners=[MongoCommandListener()])
     db.music_db = db.client[settings.db_name]
-    print("✅ Connected to MongoDB")
+    logger.info("Connected to MongoDB")
 
 async def close_mongo_connection():
     db.client.close()
-    print("❌ Closed MongoDB connection")
+    logger.info("Closed MongoDB connection")
+
+HISTORY_TTL_INDEX = "listened_at_ttl"
+INDEX_NOT_FOUND = 27
+
+async def ensure_indexes():
+    """
+    Идемпотентно создаем индексы под наши запросы
+    (create_indexes ничего не делает, если индекс уже есть).
+    """
+    plan = {
+        "users": [IndexModel([("id", ASCENDING)], name="id_unique", unique=True)],
+        # Чтение истории конкретного пользователя, свежие сверху
+        "history": [IndexModel([("user_id", ASCENDING), ("listened_at", DESCENDING)], name="user_id_listened_at")],
+    }
+    for collection, indexes in plan.items():
+        started = time.perf_counter()
+        await db.music_db[collection].create_indexes(indexes)
+        elapsed = (time.perf_counter() - started) * 1000
+        logger.info("Indexes ready for %s (%.1f ms)", collection, elapsed)
+    await sync_history_ttl()
+
+async def sync_history_ttl():
+    """
+    Старая история удаляется сама (TTL-индекс) по текущему HISTORY_TTL_DAYS.
+    create_indexes не меняет expireAfterSeconds у существующего индекса
+    (IndexOptionsConflict), поэтому срок меняем через collMod,
+    а при HISTORY_TTL_DAYS=0 индекс удаляем.
+    """
+    seconds = int(settings.history_ttl_days * 86400)
+    current = (await db.music_db.history.index_information()).get(HISTORY_TTL_INDEX)
+    if current is None:
+        if seconds:
+            await db.music_db.history.create_indexes(
+                [IndexModel([("listened_at", ASCENDING)], name=HISTORY_TTL_INDEX, expireAfterSeconds=seconds)]
+            )
+            logger.info("History TTL index created: %d s", seconds)
+    elif not seconds:
+        try:
+            await db.music_db.history.drop_index(HISTORY_TTL_INDEX)
+        except OperationFailure as e:
+            # Другой воркер успел удалить индекс раньше
+            if e.code != INDEX_NOT_FOUND:
+                raise
+        logger.info("History TTL index dropped")
+    elif current.get("expireAfterSeconds") != seconds:
+        await db.music_db.command("collMod", "history", index={"name": HISTORY_TTL_INDEX, "expireAfterSeconds": seconds})
+        logger.info("History TTL changed: %s -> %d s", current.get("expireAfterSeconds"), seconds)
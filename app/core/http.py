@@ -0,0 +1,35 @@
+import aiohttp
+import logging
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class HTTPClient:
+    session: aiohttp.ClientSession = None
+
+http = HTTPClient()
+
+def request_timeout() -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(
+        total=settings.http_total_timeout,
+        connect=settings.http_connect_timeout,
+        sock_read=settings.http_read_timeout,
+    )
+
+async def open_http_session():
+    # Один долгоживущий пул соединений на весь процесс:
+    # keep-alive до api.vk.com и CDN, кэш DNS, лимиты на хост.
+    connector = aiohttp.TCPConnector(
+        limit=settings.http_pool_limit,
+        limit_per_host=settings.http_pool_limit_per_host,
+        keepalive_timeout=settings.http_keepalive_timeout,
+        ttl_dns_cache=settings.http_dns_cache_ttl,
+    )
+    http.session = aiohttp.ClientSession(connector=connector, timeout=request_timeout())
+    logger.info("HTTP session opened")
+
+async def close_http_session():
+    if http.session is not None:
+        await http.session.close()
+        http.session = None
+    logger.info("Closed HTTP session")
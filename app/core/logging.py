@@ -0,0 +1,57 @@
+import json
+import logging
+import random
+import sys
+from datetime import datetime, timezone
+from app.core.config import settings
+
+# Передается в extra= для частых сообщений горячего пути:
+# такие записи уровня INFO и ниже пишутся с вероятностью LOG_SAMPLE_RATE
+SAMPLED = {"sampled": True}
+
+_RESERVED = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "sampled"}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Одна строка JSON на запись; поля из extra= попадают в объект как есть.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+def setup_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    if settings.log_format == "json":
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(SamplingFilter(settings.log_sample_rate))
+
+    root = logging.getLogger("app")
+    root.handlers[:] = [handler]
+    root.setLevel(settings.log_level.upper())
+    root.propagate = False
@@ -0,0 +1,334 @@
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+from app.core.config import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[name]) for name in self.labelnames), 0.0)
+
+    def export(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(a: float, b: float) -> float:
+        return a + b
+
+    def samples(self, values: Dict[Tuple[str, ...], float]):
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [counts per bucket..., sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def export(self) -> Dict[Tuple[str, ...], list]:
+        with self._lock:
+            return {key: list(state) for key, state in self._values.items()}
+
+    @staticmethod
+    def combine(a: list, b: list) -> list:
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, values: Dict[Tuple[str, ...], list]):
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state):
+                yield f"{self.name}_bucket", _format_labels(self.labelnames, key, f'le="{bound}"'), count
+            yield f"{self.name}_bucket", _format_labels(self.labelnames, key, 'le="+Inf"'), state[-1]
+            yield f"{self.name}_sum", _format_labels(self.labelnames, key), state[-2]
+            yield f"{self.name}_count", _format_labels(self.labelnames, key), state[-1]
+
+
+class Registry:
+    """
+    Минимальный реестр метрик в текстовом формате Prometheus.
+    Каждый воркер uvicorn может сбрасывать свои значения в файл (snapshot),
+    а /metrics суммирует файлы всех воркеров.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            return self._metrics[metric.name]
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> dict:
+        return {
+            name: [[list(key), value] for key, value in metric.export().items()]
+            for name, metric in self._metrics.items()
+        }
+
+    def render(self, snapshots: Optional[List[dict]] = None) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            if snapshots is None:
+                values = metric.export()
+            else:
+                values = {}
+                for snapshot in snapshots:
+                    for key, value in snapshot.get(metric.name, []):
+                        key = tuple(key)
+                        values[key] = metric.combine(values[key], value) if key in values else value
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples(values):
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+CACHE_REQUESTS = registry.counter(
+    "cache_requests_total", "Cache lookups by cache and result (hit/miss)", ["cache", "result"]
+)
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route", "status"]
+)
+ROUTE_STAGE = registry.histogram(
+    "route_stage_duration_seconds",
+    "Time spent in the endpoint body vs. response validation and serialization",
+    ["route", "stage"],
+)
+VK_LATENCY = registry.histogram(
+    "vk_request_duration_seconds", "VK API latency by method and stage (http, parse)", ["method", "stage"]
+)
+MONGO_LATENCY = registry.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ["command", "outcome"]
+)
+THREADPOOL_WAIT = registry.histogram(
+    "threadpool_queue_wait_seconds", "Time a job waited for a free worker thread", ["task"]
+)
+
+
+# --- Несколько воркеров ---
+
+def _snapshot_path(pid: int) -> str:
+    return os.path.join(settings.metrics_dir, f"metrics-{pid}.json")
+
+
+def write_snapshot():
+    if not settings.metrics_dir:
+        return
+    path = _snapshot_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def prepare_metrics_dir():
+    """
+    Убираем файлы воркеров, которых больше нет (после рестарта сервиса).
+    """
+    if not settings.metrics_dir:
+        return
+    os.makedirs(settings.metrics_dir, exist_ok=True)
+    for name in os.listdir(settings.metrics_dir):
+        if name.startswith("metrics-") and name.endswith(".json"):
+            try:
+                pid = int(name[len("metrics-"):-len(".json")])
+            except ValueError:
+                # Чужой файл с похожим именем - не наш снимок, не трогаем
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                try:
+                    os.unlink(os.path.join(settings.metrics_dir, name))
+                except FileNotFoundError:
+                    # Другой воркер убрал его раньше
+                    pass
+
+
+def collect() -> str:
+    if not settings.metrics_dir:
+        return registry.render()
+    write_snapshot()
+    snapshots = []
+    for name in os.listdir(settings.metrics_dir):
+        if name.startswith("metrics-") and name.endswith(".json"):
+            try:
+                with open(os.path.join(settings.metrics_dir, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return registry.render(snapshots)
+
+
+async def export_snapshots():
+    while True:
+        await asyncio.sleep(settings.metrics_flush_interval)
+        try:
+            await asyncio.to_thread(write_snapshot)
+        except OSError:
+            pass
+
+
+# --- Инструментирование ---
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: латентность каждого запроса по шаблону маршрута
+    (а не по конкретному пути, чтобы не плодить метки).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            HTTP_LATENCY.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Латентность команд MongoDB (pymongo вызывает слушателя из своих потоков).
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name, outcome="ok")
+
+    def failed(self, event):
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, command=event.command_name, outcome="error")
+
+
+_endpoint_timing: contextvars.ContextVar = contextvars.ContextVar("endpoint_timing", default=None)
+
+
+class TimedRoute(APIRoute):
+    """
+    Маршрут, который делит время обработчика FastAPI на тело эндпоинта
+    и все остальное (разбор параметров, валидация и сериализация ответа).
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        # include_router пересоздает маршрут с уже обернутым эндпоинтом
+        endpoint = getattr(endpoint, "__timed__", endpoint)
+
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kw):
+            started = time.perf_counter()
+            try:
+                return await endpoint(*args, **kw)
+            finally:
+                timing = _endpoint_timing.get()
+                if timing is not None:
+                    timing["endpoint"] = time.perf_counter() - started
+
+        timed_endpoint.__timed__ = endpoint
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        route = self.path
+
+        async def timed_handler(request):
+            timing = {}
+            token = _endpoint_timing.set(timing)
+            started = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                total = time.perf_counter() - started
+                _endpoint_timing.reset(token)
+                if "endpoint" in timing:
+                    ROUTE_STAGE.observe(timing["endpoint"], route=route, stage="endpoint")
+                    ROUTE_STAGE.observe(total - timing["endpoint"], route=route, stage="framework")
+
+        return timed_handler
@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import hmac
+import time
+from functools import lru_cache
+import orjson
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+@lru_cache(maxsize=8)
+def session_key(secret: str) -> bytes:
+    # Отдельный ключ, чтобы подпись сессии нельзя было выдать за подпись initData
+    return hmac.new(b"SessionToken", secret.encode(), hashlib.sha256).digest()
+
+
+def create_session_token(user: dict, ttl: int, secret: str) -> str:
+    """
+    Stateless-токен сессии: base64(payload).base64(HMAC-SHA256).
+    В payload - данные пользователя из проверенного initData и срок действия.
+    """
+    payload = _b64encode(orjson.dumps({"user": user, "exp": int(time.time()) + ttl}))
+    signature = hmac.new(session_key(secret), payload.encode(), hashlib.sha256).digest()
+    return f"{payload}.{_b64encode(signature)}"
+
+
+def verify_session_token(token: str, secret: str) -> dict:
+    """
+    Проверка подписи и срока; возвращает payload ({"user": ..., "exp": ...}).
+    """
+    try:
+        payload, signature = token.split(".")
+        received = _b64decode(signature)
+    except ValueError:
+        raise ValueError("Malformed session token")
+    expected = hmac.new(session_key(secret), payload.encode(), hashlib.sha256).digest()
+    if not hmac.compare_digest(expected, received):
+        raise ValueError("Invalid session token signature")
+
+    data = orjson.loads(_b64decode(payload))
+    if data.get("exp", 0) < time.time():
+        raise ValueError("Session token expired")
+    return data
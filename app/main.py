@@ -1,16 +1,51 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.openapi.utils import get_openapi
-from app.core.database import connect_to_mongo, close_mongo_connection
+from app.core.database import connect_to_mongo, close_mongo_connection, ensure_indexes
+from app.core.http import open_http_session, close_http_session
+from app.core.logging import setup_logging
+from app.core.metrics import MetricsMiddleware, collect, export_snapshots, prepare_metrics_dir
+from app.services.history import history_writer
+from app.services.audio_cache import audio_cache
+from app.services.covers import cover_cache
+from app.services.cache import close_shared_tiers
+from app.services.prefetch import prefetcher
+from app.services.suggest import suggest_index
+from app.core.config import settings
 from app.routers import auth, music
 from contextlib import asynccontextmanager
+import asyncio
+
+setup_logging()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: подключаемся к БД
+    # Startup: подключаемся к БД и открываем общий HTTP-пул
+    prepare_metrics_dir()
+    metrics_exporter = asyncio.create_task(export_snapshots()) if settings.metrics_dir else None
     await connect_to_mongo()
+    await ensure_indexes()
+    await open_http_session()
+    await history_writer.start()
+    await suggest_index.start()
+    if settings.audio_cache_enabled:
+        await audio_cache.start()
+    await cover_cache.start()
+    if settings.prefetch_enabled:
+        await prefetcher.start()
     yield
-    # Shutdown: отключаемся
+    # Shutdown: дописываем буфер истории и отключаемся
+    await prefetcher.stop()
+    await cover_cache.stop()
+    if settings.audio_cache_enabled:
+        await audio_cache.stop()
+    await suggest_index.stop()
+    await history_writer.stop()
+    await close_shared_tiers()
+    await close_http_session()
     await close_mongo_connection()
+    if metrics_exporter is not None:
+        metrics_exporter.cancel()
 
 # Описания тегов с эмодзи для красоты
 tags_metadata = [
@@ -72,6 +107,9 @@ app.add_middleware(
     allow_headers=["*"],  # Разрешаем все заголовки
 )
 
+# Латентность всех запросов по маршрутам (снаружи всех остальных middleware)
+app.add_middleware(MetricsMiddleware)
+
 @app.get("/", tags=["System"])
 async def root():
     """
@@ -85,9 +123,16 @@ async def root():
         "version": "1.0.0"
     }
 
+@app.get("/metrics", tags=["System"], response_class=PlainTextResponse)
+async def metrics():
+    """
+    Metrics in Prometheus text format (summed over all workers when METRICS_DIR is set)
+    """
+    body = await asyncio.to_thread(collect)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
-    from app.core.config import settings
     
     uvicorn.run(
         "app.main:app", 
@@ -1,4 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
+from datetime import datetime
 from typing import List, Optional
 
 # --- AUTH ---
@@ -42,13 +43,17 @@ class AuthResponse(BaseModel):
                     "first_name": "Иван",
                     "username": "ivan_music",
                     "language_code": "ru"
-                }
+                },
+                "session_token": "eyJ1c2VyIjp7ImlkIjoxMjM0NTY3ODl9LCJleHAiOjE3MDAwMDAwMDB9.c2lnbmF0dXJl",
+                "expires_in": 21600
             }
         }
     )
     
     status: str
     user: User
+    session_token: Optional[str] = Field(None, description="Send as `Authorization: Bearer <token>` to log in again without initData")
+    expires_in: Optional[int] = Field(None, description="Seconds until the session token expires")
 
 # --- MUSIC ---
 class Track(BaseModel):
@@ -60,6 +65,7 @@ class Track(BaseModel):
                 "artist": "Макс Корж",
                 "duration": 234,
                 "cover_url": "https://sun9-12.userapi.com/impg/c857136/v857136449/1234/photo.jpg",
+                "thumb_url": "/api/music/cover/371745449_456392423?size=96",
                 "url_api": "/api/music/download/371745449_456392423"
             }
         }
@@ -70,6 +76,7 @@ class Track(BaseModel):
     artist: str
     duration: int
     cover_url: Optional[str] = Field(None, description="URL of the album cover")
+    thumb_url: Optional[str] = Field(None, description="Internal API URL of a small cached cover thumbnail")
     url_api: str = Field(..., description="Internal API URL to download the MP3")
 
 class SearchResponse(BaseModel):
@@ -99,6 +106,7 @@ class SearchResponse(BaseModel):
     )
     
     items: List[Track]
+    next_cursor: Optional[str] = Field(None, description="Pass as `cursor` to get the next page (absent on the last page)")
 
 class HistoryItem(BaseModel):
     model_config = ConfigDict(
@@ -116,6 +124,7 @@ class HistoryItem(BaseModel):
     track_id: str
     title: str
     artist: str = "Unknown"
+    listened_at: Optional[datetime] = Field(None, description="When the track was played (for offline plays; defaults to now)")
 
 class StatusResponse(BaseModel):
     model_config = ConfigDict(
@@ -127,3 +136,90 @@ class StatusResponse(BaseModel):
     )
     
     status: str
+
+class HistoryBatchResponse(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "status": "saved",
+                "saved": 25
+            }
+        }
+    )
+    
+    status: str
+    saved: int
+
+class ArtistPlays(BaseModel):
+    artist: str
+    plays: int
+
+class LastTrack(BaseModel):
+    track_id: str
+    title: str
+    artist: str
+
+class HistorySummary(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "user_id": 123456789,
+                "plays": 342,
+                "first_played": "2025-01-10T18:21:05",
+                "last_played": "2025-03-02T09:12:44",
+                "last_track": {
+                    "track_id": "371745449_456392423",
+                    "title": "Жить в кайф",
+                    "artist": "Макс Корж"
+                },
+                "top_artists": [
+                    {"artist": "Макс Корж", "plays": 57},
+                    {"artist": "madk1d", "plays": 31}
+                ]
+            }
+        }
+    )
+    
+    user_id: int
+    plays: int = 0
+    first_played: Optional[datetime] = None
+    last_played: Optional[datetime] = None
+    last_track: Optional[LastTrack] = None
+    top_artists: List[ArtistPlays] = Field(default_factory=list)
+
+class ResolveRequest(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "track_ids": ["371745449_456392423", "474499231_456695516"]
+            }
+        }
+    )
+    
+    track_ids: List[str] = Field(..., min_length=1, max_length=100, description="Track IDs in format 'ownerId_trackId'")
+
+class ResolvedTrack(BaseModel):
+    id: str
+    url: str = Field(..., description="Direct VK audio URL (MP3 or HLS)")
+    artist: str
+    title: str
+
+class ResolveResponse(BaseModel):
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "items": [
+                    {
+                        "id": "371745449_456392423",
+                        "url": "https://cs1-66v4.vkuseraudio.net/s/v1/acmp3/example.mp3",
+                        "artist": "Макс Корж",
+                        "title": "Жить в кайф"
+                    }
+                ],
+                "missing": ["474499231_456695516"]
+            }
+        }
+    )
+    
+    items: List[ResolvedTrack]
+    missing: List[str] = Field(default_factory=list, description="IDs that could not be resolved")
@@ -1,27 +1,92 @@
-from fastapi import APIRouter, HTTPException, Body
-from app.models.schemas import InitDataRequest, AuthResponse, HistoryItem, StatusResponse
+from fastapi import APIRouter, HTTPException, Body, Header, Path, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import TypeAdapter, ValidationError
+from app.models.schemas import InitDataRequest, AuthResponse, HistoryItem, StatusResponse, HistoryBatchResponse, HistorySummary
 from app.core.config import settings
 from app.core.database import db
-from datetime import datetime
+from app.core.logging import SAMPLED
+from app.core.metrics import CACHE_REQUESTS, TimedRoute
+from app.core.security import create_session_token, verify_session_token
+from app.services.history import history_writer
+from app.services.cache import TTLCache
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import time
 import hmac
 import hashlib
+import logging
 import json
+import orjson
 from urllib.parse import parse_qsl
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(
     prefix="/auth",
     tags=["🔐 Authentication & User"],
     responses={404: {"description": "Not found"}},
+    route_class=TimedRoute,
 )
 
-def validate_init_data(init_data: str, token: str):
+@lru_cache(maxsize=8)
+def secret_keys(token: str) -> Tuple[bytes, bytes]:
+    """
+    Секретные ключи считаются один раз на токен:
+    стандартный для Mini App и альтернативный (для виджетов).
+    """
     token = token.strip().strip("'\"") # Очищаем от пробелов и кавычек
-    from urllib.parse import parse_qsl, unquote
-    import hashlib
-    import hmac
-    import json
+    return (
+        hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest(),
+        hashlib.sha256(token.encode()).digest(),
+    )
+
+# Последние записанные профили: неизменившийся профиль не переписываем
+# в MongoDB чаще, чем раз в user_upsert_interval
+saved_profiles = TTLCache(settings.user_upsert_cache_size, settings.user_upsert_interval)
+
+# Недавно проверенные initData: повторный логин из той же сессии Mini App
+# не требует повторной криптографии
+verified_init_data = TTLCache(settings.auth_cache_size, settings.auth_cache_ttl)
+
+def _signature_matches(key: bytes, check_str: str, received_hash: str) -> bool:
+    calc_hash = hmac.new(key, check_str.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(calc_hash.encode(), received_hash.lower().encode())
+
+def _check_string(fields) -> str:
+    return "\n".join(f"{k}={v}" for k, v in fields)
+
+def _validate_legacy(params: dict, received_hash: str, keys: Tuple[bytes, bytes]) -> bool:
+    """
+    Старые варианты проверки: альтернативный ключ, только базовые поля,
+    исправленные слеши в user. Включаются настройкой AUTH_LEGACY_VARIANTS.
+    """
+    full_sorted = sorted(params.items())
+    core_keys = ["user", "auth_date", "query_id"]
+    core_sorted = [(k, v) for k, v in full_sorted if k in core_keys]
+
+    for key in keys:
+        for fields in (full_sorted, core_sorted):
+            if not fields:
+                continue
+            combinations = [_check_string(fields)]
+            fields_fixed = [(k, v.replace("\\/", "/") if k == "user" else v) for k, v in fields]
+            if fields_fixed != fields:
+                combinations.append(_check_string(fields_fixed))
+
+            for check_str in combinations:
+                if _signature_matches(key, check_str, received_hash):
+                    return True
+    return False
+
+def validate_init_data(init_data: str, token: str):
+    cache_key = hashlib.sha256(init_data.encode()).hexdigest()
+    cached = verified_init_data.get(cache_key)
+    if cached is not None:
+        CACHE_REQUESTS.inc(cache="init_data", result="hit")
+        return dict(cached)
+    CACHE_REQUESTS.inc(cache="init_data", result="miss")
 
-    # 1. Собираем все параметры
     params = dict(parse_qsl(init_data))
     if "hash" not in params:
         raise ValueError("Hash is missing")
@@ -29,67 +94,87 @@ def validate_init_data(init_data: str, token: str):
     received_hash = params.pop("hash")
     params.pop("signature", None) # Telegram v7.0+
 
-    # 2. Подготовка вариантов секретных ключей
-    keys = [
-        hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest(), # Стандарт
-        hashlib.sha256(token.encode()).digest() # Альтернативный (для виджетов)
-    ]
+    keys = secret_keys(token)
+    valid = _signature_matches(keys[0], _check_string(sorted(params.items())), received_hash)
+    if not valid and settings.auth_legacy_variants:
+        valid = _validate_legacy(params, received_hash, keys)
+    if not valid:
+        raise ValueError("Invalid hash signature")
 
-    # 3. Подготовка вариантов наборов полей
-    # Вариант А: Все что пришло (отсортировано)
-    full_sorted = sorted(params.items())
-    
-    # Вариант Б: Только базовые (user, auth_date, query_id)
-    core_keys = ["user", "auth_date", "query_id"]
-    core_sorted = sorted([(k, v) for k, v in params.items() if k in core_keys])
+    if "user" not in params:
+        raise ValueError("User is missing")
+    user = json.loads(params["user"])
+    verified_init_data.set(cache_key, user)
+    return dict(user)
 
-    field_sets = [full_sorted, core_sorted]
+def session_secret() -> str:
+    return settings.session_secret or settings.bot_token
 
-    # 4. Перебор всех комбинаций
-    for key in keys:
-        for fields in field_sets:
-            if not fields: continue
-            
-            # Пробуем два вида строки: как есть и с исправленными слешами в user
-            combinations = []
-            
-            # Подвариант 1: Как пришло
-            combinations.append("\n".join(f"{k}={v}" for k, v in fields))
-            
-            # Подвариант 2: С исправлением слешей (если есть user)
-            has_user = False
-            fields_fixed = []
-            for k, v in fields:
-                if k == "user" and "\\/" in v:
-                    has_user = True
-                    fields_fixed.append((k, v.replace("\\/", "/")))
-                else:
-                    fields_fixed.append((k, v))
-            if has_user:
-                combinations.append("\n".join(f"{k}={v}" for k, v in fields_fixed))
+async def save_user(user_info: dict):
+    """
+    Upsert профиля с троттлингом: пишем, только если поля изменились
+    или с прошлой записи прошло больше user_upsert_interval.
+    """
+    user_id = user_info.get("id")
+    profile = {
+        "id": user_id,
+        "first_name": user_info.get("first_name", ""),
+        "username": user_info.get("username", ""),
+        "language_code": user_info.get("language_code", "en"),
+        "photo_url": user_info.get("photo_url", ""),
+    }
+    if saved_profiles.get(user_id) == profile:
+        CACHE_REQUESTS.inc(cache="user_upsert", result="hit")
+        return
+    CACHE_REQUESTS.inc(cache="user_upsert", result="miss")
 
-            for check_str in combinations:
-                calc_hash = hmac.new(key, check_str.encode(), hashlib.sha256).hexdigest()
-                if calc_hash.lower() == received_hash.lower():
-                    print(f"✅ Auth SUCCESS! Variant matched.")
-                    # Возвращаем данные пользователя
-                    user_val = next((v for k, v in fields if k == "user"), None)
-                    return json.loads(user_val)
-
-    # Если ничего не помогло - выводим финальный дебаг для отладки
-    raw_sorted_str = "\n".join(f"{k}={v}" for k, v in full_sorted)
-    print(f"--- FATAL AUTH FAILURE ---")
-    print(f"Final Check String Attempted:\n{raw_sorted_str}")
-    print(f"Expected Hash: {received_hash}")
-    print(f"Calculated (Std): {hmac.new(keys[0], raw_sorted_str.encode(), hashlib.sha256).hexdigest()}")
-    print(f"--------------------------")
-    raise ValueError("Invalid hash signature")
+    await db.music_db.users.update_one(
+        {"id": user_id},
+        {"$set": {**profile, "last_login": datetime.utcnow()}},
+        upsert=True
+    )
+    saved_profiles.set(user_id, profile)
+
+def login_response(user_info: dict, token: Optional[str] = None, expires_at: Optional[float] = None) -> dict:
+    if token is None:
+        token = create_session_token(user_info, settings.session_ttl, session_secret())
+        expires_at = time.time() + settings.session_ttl
+    return {
+        "status": "ok",
+        "user": user_info,
+        "session_token": token,
+        "expires_in": max(0, int(expires_at - time.time())),
+    }
 
 @router.post("/login", response_model=AuthResponse)
-async def login(request: InitDataRequest):
+async def login(
+    request: Optional[InitDataRequest] = None,
+    authorization: Optional[str] = Header(None, description="`Bearer <session_token>` from a previous login"),
+):
     """
     🔐 **Authenticate user via Telegram Mini App**
+
+    The first login sends `initData`; the response carries a signed
+    `session_token`. While it is valid, the client can log in again with
+    `Authorization: Bearer <session_token>` and no body - no initData
+    validation is needed. An expired or invalid token falls back to `initData`
+    if it is sent as well.
     """
+    if authorization and authorization.startswith("Bearer "):
+        token = authorization[len("Bearer "):].strip()
+        try:
+            session = verify_session_token(token, session_secret())
+        except ValueError as e:
+            if request is None:
+                raise HTTPException(status_code=401, detail=str(e))
+        else:
+            user_info = session["user"]
+            await save_user(user_info)
+            return login_response(user_info, token, session["exp"])
+
+    if request is None:
+        raise HTTPException(status_code=401, detail="initData or session token is required")
+
     # --- DEBUG BYPASS ---
     if settings.debug and request.initData.startswith("debug:"):
         user_id = int(request.initData.split(":")[1])
@@ -101,38 +186,21 @@ async def login(request: InitDataRequest):
             "photo_url": ""
         }
         # Регистрируем в базе даже через дебаг
-        user_doc = {**user_info, "last_login": datetime.utcnow()}
-        await db.music_db.users.update_one({"id": user_id}, {"$set": user_doc}, upsert=True)
-        return {"status": "ok", "user": user_info}
+        await save_user(user_info)
+        return login_response(user_info)
 
     try:
         user_info = validate_init_data(request.initData, settings.bot_token)
     except Exception as e:
-        print(f"❌ Auth Error: {e}")
+        logger.info("Auth error: %s", e, extra=SAMPLED)
         raise HTTPException(status_code=401, detail=str(e))
     
     user_id = user_info.get("id")
-    print(f"✅ User Login Success: {user_info.get('first_name')} (ID: {user_id})")
-    
-    user_doc = {
-        "id": user_id,
-        "first_name": user_info.get("first_name", ""),
-        "username": user_info.get("username", ""),
-        "language_code": user_info.get("language_code", "en"),
-        "photo_url": user_info.get("photo_url", ""),
-        "last_login": datetime.utcnow()
-    }
+    logger.info("User login: %s", user_id, extra=SAMPLED)
     
-    await db.music_db.users.update_one(
-        {"id": user_id},
-        {"$set": user_doc},
-        upsert=True
-    )
+    await save_user(user_info)
         
-    return {
-        "status": "ok",
-        "user": user_info
-    }
+    return login_response(user_info)
 
 @router.post("/history", response_model=StatusResponse)
 async def add_history(item: HistoryItem):
@@ -140,6 +208,7 @@ async def add_history(item: HistoryItem):
     📊 **Add track to user listening history**
     
     Records when a user listens to a track for analytics and personalized recommendations.
+    The event is queued and written to MongoDB in bulk shortly after the response.
     
     **Parameters:**
     - `user_id`: Telegram user ID
@@ -167,8 +236,110 @@ async def add_history(item: HistoryItem):
     }
     ```
     """
-    collection = db.music_db.history
-    doc = item.dict()
-    doc['listened_at'] = datetime.utcnow()
-    await collection.insert_one(doc)
+    await history_writer.add(history_doc(item, datetime.utcnow()))
     return {"status": "saved"}
+
+history_items = TypeAdapter(List[HistoryItem])
+
+def history_doc(item: HistoryItem, now: datetime) -> dict:
+    doc = item.dict()
+    listened_at = doc['listened_at'] or now
+    if listened_at.tzinfo is not None:
+        listened_at = listened_at.astimezone(timezone.utc).replace(tzinfo=None)
+    # Время из будущего (сбитые часы на телефоне) не принимаем
+    doc['listened_at'] = min(listened_at, now)
+    return doc
+
+def import_doc(item: HistoryItem, now: datetime) -> dict:
+    doc = history_doc(item, now)
+    if item.listened_at is not None:
+        # Событие с исходным временем однозначно: повтор пакета после
+        # ошибки или таймаута не создаст дублей
+        key = f"{item.user_id}:{item.track_id}:{item.listened_at.isoformat()}"
+        doc['_id'] = hashlib.sha256(key.encode()).hexdigest()[:24]
+    return doc
+
+@router.post(
+    "/history/batch",
+    response_model=HistoryBatchResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "type": "array",
+                        "maxItems": settings.history_import_max_items,
+                        "items": {"$ref": "#/components/schemas/HistoryItem"},
+                    }
+                },
+                "application/x-ndjson": {
+                    "schema": {"type": "string", "description": "One HistoryItem JSON object per line"}
+                },
+            },
+        }
+    },
+)
+async def add_history_batch(request: Request):
+    """
+    📦 **Add many history items at once**
+
+    For plays collected offline or queued on the client. Accepts a JSON array
+    or NDJSON (`Content-Type: application/x-ndjson`, one item per line) of up to
+    `HISTORY_IMPORT_MAX_ITEMS` items, written with a single bulk insert.
+    Set `listened_at` to keep the original play time; such items are
+    deduplicated, so a batch can be safely re-sent after an error.
+    """
+    body = await request.body()
+    try:
+        if "ndjson" in request.headers.get("content-type", ""):
+            raw = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            raw = orjson.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed body: {e}")
+    if not isinstance(raw, list):
+        raise HTTPException(status_code=400, detail="Expected a JSON array of history items")
+    if len(raw) > settings.history_import_max_items:
+        raise HTTPException(status_code=413, detail=f"At most {settings.history_import_max_items} items per request")
+
+    try:
+        items = history_items.validate_python(raw)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
+    if not items:
+        return {"status": "saved", "saved": 0}
+
+    now = datetime.utcnow()
+    if not await history_writer.write_batch([import_doc(item, now) for item in items]):
+        raise HTTPException(status_code=503, detail="History storage is unavailable, retry later")
+    return {"status": "saved", "saved": len(items)}
+
+@router.get("/history/{user_id}/summary", response_model=HistorySummary)
+async def history_summary(
+    user_id: int = Path(..., description="Telegram user ID", example=123456789),
+):
+    """
+    📈 **Listening summary for a user**
+
+    Total plays, first and last play, the last track and top artists.
+    Served from a per-user rollup that is updated with every history write,
+    so the read is a single document lookup.
+    """
+    doc = await db.music_db.history_summary.find_one({"_id": user_id})
+    if doc is None:
+        return {"user_id": user_id}
+
+    artists = sorted((doc.get("artists") or {}).values(), key=lambda a: a.get("plays", 0), reverse=True)
+    return {
+        "user_id": user_id,
+        "plays": doc.get("plays", 0),
+        "first_played": doc.get("first_played"),
+        "last_played": doc.get("last_played"),
+        "last_track": doc.get("last_track"),
+        "top_artists": [
+            {"artist": a.get("name", ""), "plays": a.get("plays", 0)}
+            for a in artists[:settings.history_summary_top_artists]
+        ],
+    }
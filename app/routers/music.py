@@ -1,52 +1,290 @@
-from fastapi import APIRouter, HTTPException, Query, Path
-from fastapi.responses import RedirectResponse
-from app.models.schemas import SearchResponse, Track
-from app.services.vk import vk_service
+from fastapi import APIRouter, HTTPException, Query, Path, Header, Request
+from fastapi.responses import FileResponse, ORJSONResponse, RedirectResponse, Response, StreamingResponse
+from app.core.config import settings
+from app.core.metrics import TimedRoute
+from app.models.schemas import SearchResponse, Track, ResolveRequest, ResolveResponse
+from app.services.vk import AudioInfo, vk_service
+from app.services.recommendations import recommender
+from app.services import proxy
+from app.services.audio_cache import audio_cache
+from app.services.suggest import suggest_index
+from app.services.covers import cover_cache
+from app.services.responses import etag_matches, response_cache
+from typing import Optional, Tuple
+import asyncio
+import aiohttp
+import base64
+import time
 from urllib.parse import unquote
 import re
+import orjson
+
+TRACK_ID_RE = re.compile(r'^-?\d+_\d+$')
 
 router = APIRouter(
     prefix="/music",
     tags=["🎵 Music"],
+    route_class=TimedRoute,
 )
 
-@router.get("/search", response_model=SearchResponse)
-async def search(q: str = Query(..., description="Search query (artist, song title, or both)", example="Макс Корж")):
+def encode_cursor(offset: int, limit: int) -> str:
+    return base64.urlsafe_b64encode(f"{offset}:{limit}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        offset, limit = (int(part) for part in raw.split(":"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not (0 <= offset < settings.search_max_results and 1 <= limit <= 50):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return offset, limit
+
+@router.get("/search", response_model=SearchResponse, responses={304: {"description": "Not modified"}})
+async def search(
+    request: Request,
+    q: str = Query(..., description="Search query (artist, song title, or both)", example="Макс Корж"),
+    limit: int = Query(20, description="Page size", ge=1, le=50),
+    cursor: Optional[str] = Query(None, description="`next_cursor` from the previous page"),
+):
     """
     🔍 **Search for music tracks in VK**
+
+    Results are paginated: pass `next_cursor` from the response as `cursor`
+    to get the next page (the page size is kept in the cursor).
+
+    Responses carry an `ETag` and `Cache-Control` matching the cached result:
+    repeat the request with `If-None-Match` to get `304 Not Modified`.
     """
     if not q:
         raise HTTPException(status_code=400, detail="Empty query")
-    
-    tracks = await vk_service.search_tracks(q, limit=20)
-    return {"items": tracks}
+
+    offset = 0
+    if cursor:
+        offset, limit = decode_cursor(cursor)
+
+    tracks = await vk_service.search_tracks(q, limit, offset)
+
+    next_cursor = None
+    # Короткая страница - последняя
+    if len(tracks) >= limit and offset + limit < settings.search_max_results:
+        next_cursor = encode_cursor(offset + limit, limit)
+        if settings.search_prefetch_next:
+            vk_service.prefetch_search(q, limit, offset + limit)
+    if offset and settings.search_prefetch_next:
+        vk_service.prefetch_search(q, limit, max(0, offset - limit))
+
+    # Элементы уже в форме Track (см. VKService._search): response_model
+    # остается для OpenAPI, а повторную валидацию пропускаем.
+    # Пока в кэше тот же результат, тело и ETag берутся готовыми
+    return response_cache.respond(
+        request,
+        {"items": tracks, "next_cursor": next_cursor},
+        key=vk_service.search_key(q, limit, offset),
+        source=tracks,
+        max_age=vk_service.search_expires_in(q, limit, offset),
+    )
+
+@router.get(
+    "/search/stream",
+    response_class=StreamingResponse,
+    responses={200: {"content": {"application/x-ndjson": {}}, "description": "One Track JSON object per line"}},
+)
+async def search_stream(
+    q: str = Query(..., description="Search query (artist, song title, or both)", example="Макс Корж"),
+    pages: int = Query(3, description="Number of pages to stream", ge=1, le=settings.search_stream_max_pages),
+    limit: int = Query(20, description="Page size", ge=1, le=50),
+):
+    """
+    🌊 **Stream search results as NDJSON**
+
+    Tracks are sent one per line as soon as each VK page arrives, so the
+    client can render the first results before the rest are loaded.
+    """
+    if not q:
+        raise HTTPException(status_code=400, detail="Empty query")
+
+    async def lines():
+        first = await vk_service.search_tracks(q, limit)
+        seen = set()
+        for track in first:
+            seen.add(track['id'])
+            yield orjson.dumps(track) + b"\n"
+        if len(first) < limit:
+            return
+
+        # Остальные страницы запрашиваем параллельно, отдаем по порядку
+        offsets = [page * limit for page in range(1, pages) if page * limit < settings.search_max_results]
+        rest = [asyncio.ensure_future(vk_service.search_tracks(q, limit, offset)) for offset in offsets]
+        try:
+            for future in rest:
+                tracks = await future
+                for track in tracks:
+                    # Одна и та же песня может попасть на соседние страницы
+                    if track['id'] not in seen:
+                        seen.add(track['id'])
+                        yield orjson.dumps(track) + b"\n"
+                if len(tracks) < limit:
+                    break
+        finally:
+            for future in rest:
+                future.cancel()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/suggest", response_model=SearchResponse)
+async def suggest(
+    q: str = Query(..., description="What the user has typed so far", example="макс ко"),
+    limit: int = Query(10, description="Maximum number of suggestions", ge=1, le=20),
+):
+    """
+    ⚡ **Instant autocomplete**
+
+    Answered from a local index of tracks seen in search results and listening
+    history; never calls VK, tolerates typos and unfinished words.
+    Unknown queries return an empty list - use `/search` for the full results.
+    """
+    return ORJSONResponse({"items": suggest_index.search(q, limit)})
 
 @router.get("/download/{track_id}")
 async def download(
-    track_id: str = Path(..., description="Track ID in format 'ownerId_trackId'", example="371745449_456392423")
+    track_id: str = Path(..., description="Track ID in format 'ownerId_trackId'", example="371745449_456392423"),
+    refresh: bool = Query(False, description="Re-resolve the URL (e.g. after the CDN answered 403)"),
+    stream: Optional[bool] = Query(None, description="Stream the audio through this server instead of redirecting (default: DOWNLOAD_PROXY setting)"),
+    range_header: Optional[str] = Header(None, alias="Range", description="Byte range for seeking in proxy mode"),
 ):
     """
     ⬇️ **Get direct musical link (Redirect)**
     
     Redirects to the direct VK audio URL (MP3 or HLS).
     This avoids downloading the file to the local server and fixes HLS segment errors.
+    Resolved URLs are cached until shortly before they expire; pass `refresh=true`
+    if the cached link stopped working.
+
+    In proxy mode (`stream=true` or `DOWNLOAD_PROXY=true`) the MP3 is streamed
+    through this server with `Range` support; HLS playlists are always redirected.
+
+    Popular tracks are kept in an on-disk cache (`AUDIO_CACHE_ENABLED=true`) and
+    served straight from disk, HLS tracks assembled into a single MP3.
     """
     # Валидация track_id (должен быть в формате owner_id_audio_id)
-    if not re.match(r'^-?\d+_\d+$', track_id):
+    if not TRACK_ID_RE.match(track_id):
         # Игнорируем запросы сегментов .ts или левые ID
         raise HTTPException(status_code=400, detail="Invalid track ID format")
 
+    if settings.audio_cache_enabled:
+        audio_cache.record_play(track_id)
+        cached = await audio_cache.lookup(track_id)
+        if cached is not None:
+            # FileResponse сам обрабатывает Range; stat уже сделан, поэтому
+            # файл, удаленный другим воркером, - это промах, а не 500
+            path, stat = cached
+            return FileResponse(path, media_type="audio/mpeg", stat_result=stat)
+
+    if refresh:
+        vk_service.invalidate_audio_url(track_id)
+
     song = await vk_service.get_audio_url(track_id)
     
     if not song or not song.url:
         raise HTTPException(status_code=404, detail="Track not found or restricted")
+
+    use_proxy = settings.download_proxy if stream is None else stream
+    if use_proxy and ".m3u8" not in song.url:
+        return await proxy_download(track_id, song, range_header)
         
     return RedirectResponse(url=song.url)
+
+@router.get(
+    "/cover/{track_id}",
+    response_class=FileResponse,
+    responses={200: {"content": {"image/jpeg": {}}, "description": "Cover thumbnail"}, 304: {"description": "Not modified"}},
+)
+async def cover(
+    track_id: str = Path(..., description="Track ID in format 'ownerId_trackId'", example="371745449_456392423"),
+    size: int = Query(96, description="Thumbnail side in pixels (the nearest prepared size is served)", ge=1, le=1200),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """
+    🖼 **Album cover thumbnail**
+
+    The VK cover is downloaded once, resized to all configured sizes and kept
+    in a disk cache. Responses carry an `ETag` and long-lived `Cache-Control`.
+    """
+    if not TRACK_ID_RE.match(track_id):
+        raise HTTPException(status_code=400, detail="Invalid track ID format")
+
+    try:
+        path = await cover_cache.get(track_id, size)
+    except Exception:
+        raise HTTPException(status_code=502, detail="Cover is unavailable")
+    if path is None:
+        raise HTTPException(status_code=404, detail="Track has no cover")
+
+    etag = cover_cache.etag(path)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.cover_max_age}, immutable",
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/jpeg", headers=headers)
+
+async def proxy_download(track_id: str, song: AudioInfo, range_header: Optional[str]):
+    proxy.active_streams.acquire()
+    try:
+        started = time.perf_counter()
+        try:
+            resp = await proxy.open_stream(song.url, range_header, song.user_agent)
+        except proxy.UpstreamForbidden:
+            # Ссылка из кэша больше не работает - разрешаем трек заново
+            vk_service.invalidate_audio_url(track_id)
+            song = await vk_service.get_audio_url(track_id)
+            if not song or not song.url:
+                raise HTTPException(status_code=404, detail="Track not found or restricted")
+            resp = await proxy.open_stream(song.url, range_header, song.user_agent)
+    except proxy.UpstreamForbidden:
+        proxy.active_streams.release()
+        raise HTTPException(status_code=502, detail="CDN refused the stream")
+    except asyncio.TimeoutError:
+        proxy.active_streams.release()
+        raise HTTPException(status_code=504, detail="CDN did not respond in time")
+    except aiohttp.ClientError:
+        proxy.active_streams.release()
+        raise HTTPException(status_code=502, detail="CDN is unavailable")
+    except Exception:
+        proxy.active_streams.release()
+        raise
+    return proxy.stream_response(resp, started)
+
+@router.post("/resolve", response_model=ResolveResponse)
+async def resolve(request: ResolveRequest):
+    """
+    🔗 **Resolve direct audio URLs for a list of tracks**
     
-@router.get("/recommendations", response_model=SearchResponse)
+    All IDs are resolved with a single batched VK `audio.getById` call,
+    so a client can pre-resolve a whole playlist in one round trip.
+    """
+    invalid = [track_id for track_id in request.track_ids if not TRACK_ID_RE.match(track_id)]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid track ID format: {', '.join(invalid)}")
+
+    songs = await vk_service.get_audio_urls(request.track_ids)
+
+    items, missing = [], []
+    for track_id, song in songs.items():
+        if song and song.url:
+            items.append({"id": track_id, "url": song.url, "artist": song.artist, "title": song.title})
+        else:
+            missing.append(track_id)
+    return ORJSONResponse({"items": items, "missing": missing})
+    
+@router.get("/recommendations", response_model=SearchResponse, responses={304: {"description": "Not modified"}})
 async def recommendations(
+    request: Request,
     track_id: str = Query(None, description="Track ID to base recommendations on", example="371745449_456392423"),
     query: str = Query(None, description="Search query for recommendations", example="Макс Корж"),
+    user_id: int = Query(None, description="Telegram user ID for personal recommendations from listening history", example=123456789),
     limit: int = Query(20, description="Maximum number of recommendations", ge=1, le=50)
 ):
     """
@@ -55,36 +293,72 @@ async def recommendations(
     Returns recommended tracks based on:
     - A specific track (via `track_id`)
     - A search query (via `query`)
-    - Popular tracks (if neither is provided)
+    - The user's listening history (via `user_id`)
+    - Popular tracks (if none is provided)
     
     **Parameters:**
     - `track_id` (optional): Get recommendations similar to this track
     - `query` (optional): Search for recommendations matching this query
+    - `user_id` (optional): Personal recommendations ranked by artist affinity and
+      tracks that other users play together with the user's recent tracks
     - `limit`: Number of tracks to return (1-50, default: 20)
     
     **Returns:**
     - List of recommended tracks with full metadata
+    - `ETag` and `Cache-Control` headers (`If-None-Match` gives `304 Not Modified`)
     
     **Examples:**
     ```
     GET /api/music/recommendations?track_id=371745449_456392423
     GET /api/music/recommendations?query=Макс Корж&limit=10
+    GET /api/music/recommendations?user_id=123456789
     GET /api/music/recommendations (returns popular tracks)
     ```
     """
+    # Ответ строится из результата поиска в кэше: его версия и время жизни
+    # задают ETag и Cache-Control. Персональная выдача каждый раз новая
+    key, source, max_age = None, None, 0.0
     if query:
         tracks = await vk_service.search_tracks(query, limit)
+        key, source = f"recommendations:{vk_service.search_key(query, limit)}", tracks
+        max_age = vk_service.search_expires_in(query, limit)
     elif track_id:
         # Находим артиста по ID трека и ищем его песни
         song = await vk_service.get_audio_url(track_id)
         if song:
-            tracks = await vk_service.search_tracks(song.artist, limit)
+            source = await vk_service.search_tracks(song.artist, limit)
             # Убираем сам трек из выдачи
-            tracks = [t for t in tracks if t['id'] != track_id]
+            tracks = [t for t in source if t['id'] != track_id]
+            key = f"recommendations:{track_id}:{vk_service.search_key(song.artist, limit)}"
+            max_age = vk_service.search_expires_in(song.artist, limit)
         else:
             tracks = []
+    elif user_id is not None:
+        tracks = await personal_recommendations(user_id, limit)
     else:
-        # Fallback на популярное если ничего не задано
+        tracks = []
+
+    if not tracks and not query and not track_id:
+        # Fallback на популярное если ничего не задано (или истории еще нет)
         tracks = await vk_service.search_tracks("Top 100", limit)
-        
-    return {"items": tracks}
+        key, source = f"recommendations:{vk_service.search_key('Top 100', limit)}", tracks
+        max_age = vk_service.search_expires_in("Top 100", limit)
+
+    return response_cache.respond(
+        request, {"items": tracks}, key=key, source=source, max_age=max_age, private=user_id is not None
+    )
+
+async def personal_recommendations(user_id: int, limit: int):
+    tracks = await recommender.recommend(user_id, limit)
+    if len(tracks) >= limit:
+        return tracks
+
+    # Пул кандидатов еще холодный - добираем треками любимого артиста
+    # (результаты поиска заодно пополнят пул для следующих запросов)
+    profile = await recommender.get_profile(user_id)
+    artist = recommender.top_artist(profile) if profile else None
+    if artist:
+        known = {t['id'] for t in tracks} | set(profile.recent)
+        extra = await vk_service.search_tracks(artist, limit)
+        tracks += [t for t in extra if t['id'] not in known][:limit - len(tracks)]
+    return tracks
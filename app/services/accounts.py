@@ -0,0 +1,118 @@
+import hashlib
+import itertools
+import logging
+import os
+import tempfile
+import time
+from typing import List, Optional
+from app.core.config import settings
+from app.core.metrics import registry
+from app.services.ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+ACCOUNT_CALLS = registry.counter("vk_account_calls_total", "VK API calls per account", ["account"])
+ACCOUNT_ERRORS = registry.counter("vk_account_errors_total", "VK API errors per account and error code", ["account", "code"])
+ACCOUNT_LATENCY = registry.histogram("vk_account_latency_seconds", "VK API call latency per account", ["account"])
+ACCOUNT_DISABLED = registry.counter("vk_account_disabled_total", "Times an account was taken out of rotation", ["account", "reason"])
+
+
+class VKAccount:
+    """
+    Один токен VK со своим User-Agent, бюджетом запросов и здоровьем.
+    В метриках аккаунт виден по номеру, а не по токену.
+    """
+
+    def __init__(self, index: int, token: str, user_agent: str):
+        self.index = index
+        self.label = str(index)
+        self.token = token
+        self.user_agent = user_agent
+        self.limiter = TokenBucket(
+            rate=settings.vk_rate_limit,
+            burst=settings.vk_rate_burst,
+            max_queue=settings.vk_queue_size,
+            path=self._bucket_path(token),
+        )
+        self.in_flight = 0
+        self.disabled_until = 0.0
+
+    @staticmethod
+    def _bucket_path(token: str) -> str:
+        directory = settings.vk_rate_limit_dir or tempfile.gettempdir()
+        digest = hashlib.sha256(token.encode()).hexdigest()[:16]
+        return os.path.join(directory, f"vk-music-bot-{digest}.bucket")
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.disabled_until
+
+    @property
+    def load(self) -> int:
+        return self.in_flight + self.limiter.waiting
+
+    def disable(self, seconds: float, reason: str):
+        was_healthy = self.healthy
+        self.disabled_until = time.monotonic() + seconds
+        # Если аккаунт последний, запросы пойдут с него же - хотя бы не пачкой
+        self.limiter.drain()
+        if not was_healthy:
+            # Ответы на запросы, отправленные до выключения
+            return
+        ACCOUNT_DISABLED.inc(account=self.label, reason=reason)
+        logger.warning("VK account #%d disabled for %.0f s (%s)", self.index, seconds, reason)
+
+    def record_call(self, latency: float):
+        ACCOUNT_CALLS.inc(account=self.label)
+        ACCOUNT_LATENCY.observe(latency, account=self.label)
+
+    def record_error(self, code):
+        ACCOUNT_ERRORS.inc(account=self.label, code=code)
+
+
+class AccountPool:
+    """
+    Пул токенов VK: запросы распределяются между здоровыми аккаунтами
+    (наименее загруженный или по кругу), проблемные аккаунты временно
+    выводятся из ротации, пока в ней есть кто-то еще.
+    """
+
+    def __init__(self, accounts: List[VKAccount], strategy: str = "least_loaded"):
+        self.accounts = accounts
+        self.strategy = strategy
+        self._rotation = itertools.cycle(range(len(accounts)))
+
+    def __len__(self):
+        return len(self.accounts)
+
+    @property
+    def primary(self) -> VKAccount:
+        return self.accounts[0]
+
+    @property
+    def queued(self) -> int:
+        # Запросы, ждущие бюджета в ведрах этого воркера
+        return sum(a.limiter.waiting for a in self.accounts)
+
+    def pick(self, exclude: Optional[VKAccount] = None) -> VKAccount:
+        # Круговой сдвиг: при равной нагрузке аккаунты чередуются
+        start = next(self._rotation)
+        ordered = self.accounts[start:] + self.accounts[:start]
+        candidates = [a for a in ordered if a.healthy and a is not exclude]
+        if not candidates:
+            candidates = [a for a in ordered if a.healthy]
+        if not candidates:
+            # Выключены все (например, единственный токен): не отказываем сами,
+            # а идем с тем, кто вернется раньше, - его ведро уже притормозили
+            return min(ordered, key=lambda a: a.disabled_until)
+        if self.strategy == "round_robin":
+            return candidates[0]
+        return min(candidates, key=lambda a: a.load)
+
+
+def build_account_pool() -> AccountPool:
+    accounts = [
+        VKAccount(index, token, user_agent)
+        for index, (token, user_agent) in enumerate(settings.vk_accounts())
+    ]
+    return AccountPool(accounts, settings.vk_account_strategy)
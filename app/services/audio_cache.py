@@ -0,0 +1,346 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+import aiohttp
+from app.core.config import settings
+from app.core.http import http, request_timeout
+from app.core.metrics import CACHE_REQUESTS
+from app.services.vk import vk_service
+
+logger = logging.getLogger(__name__)
+
+KEY_RE = re.compile(r'#EXT-X-KEY:(.*)')
+ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+# Сколько копить скачанного перед записью на диск (запись идет в потоке)
+WRITE_BUFFER = 1 << 20
+
+
+class HLSError(Exception):
+    pass
+
+
+def parse_attributes(line: str) -> Dict[str, str]:
+    return {name: value.strip('"') for name, value in ATTR_RE.findall(line)}
+
+
+def parse_playlist(text: str, base_url: str) -> Tuple[List[Tuple[str, Optional[dict], int]], Optional[str]]:
+    """
+    Разбор m3u8: список сегментов (url, параметры ключа, номер в последовательности)
+    или ссылка на вложенный плейлист, если это master playlist.
+    """
+    segments = []
+    key = None
+    sequence = 0
+    expect_variant = False
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-STREAM-INF'):
+            expect_variant = True
+        elif line.startswith('#EXT-X-KEY'):
+            attrs = parse_attributes(KEY_RE.match(line).group(1))
+            if attrs.get('METHOD', 'NONE') == 'NONE':
+                key = None
+            else:
+                attrs['URI'] = urljoin(base_url, attrs.get('URI', ''))
+                key = attrs
+        elif line.startswith('#'):
+            continue
+        elif expect_variant:
+            return [], urljoin(base_url, line)
+        else:
+            segments.append((urljoin(base_url, line), key, sequence))
+            sequence += 1
+    return segments, None
+
+
+def decrypt_segment(data: bytes, key: bytes, iv: bytes) -> bytes:
+    # cryptography - опциональная зависимость, нужна только для зашифрованных HLS
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives import padding
+
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    plain = decryptor.update(data) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    return unpadder.update(plain) + unpadder.finalize()
+
+
+class AudioCache:
+    """
+    Локальный кэш аудио на диске: файл на track_id, ограничение по байтам
+    и вытеснение LRU. Популярные треки скачивает фоновый воркер
+    (HLS собирается из сегментов в один MP3), дальше /download отдает
+    их прямо с диска без обращения к VK.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._plays: Dict[str, Tuple[int, float]] = {}
+        self._queued: set = set()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+
+    def path_for(self, track_id: str) -> Path:
+        digest = hashlib.sha256(track_id.encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}.mp3"
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self._scan)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(settings.audio_cache_workers)]
+        logger.info("Audio cache: %d files, %.1f MB", len(self._index), self.total_bytes / 2**20)
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _list_files(self) -> List[Tuple[float, Path, int]]:
+        files = []
+        for path in self.directory.glob("*/*.mp3"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, path, stat.st_size))
+        return sorted(files)
+
+    def _scan(self):
+        for _, path, size in self._list_files():
+            self._index[str(path)] = size
+            self.total_bytes += size
+
+    # --- Чтение ---
+
+    @staticmethod
+    def _stat(path: Path) -> Optional[os.stat_result]:
+        try:
+            return path.stat()
+        except FileNotFoundError:
+            return None
+
+    async def lookup(self, track_id: str) -> Optional[Tuple[Path, os.stat_result]]:
+        """
+        Файл трека и его stat (чтобы FileResponse не делал stat повторно)
+        или None. Файловые вызовы идут в пуле потоков.
+        """
+        path = self.path_for(track_id)
+        key = str(path)
+        stat = await asyncio.to_thread(self._stat, path)
+        if stat is None:
+            # Файла нет или его удалил другой воркер
+            size = self._index.pop(key, None)
+            if size is not None:
+                self.total_bytes -= size
+            CACHE_REQUESTS.inc(cache="audio_file", result="miss")
+            return None
+        if key in self._index:
+            self._index.move_to_end(key)
+        else:
+            # Файл скачал другой воркер - подхватываем в свой индекс
+            await self._add(path, stat.st_size)
+        CACHE_REQUESTS.inc(cache="audio_file", result="hit")
+        return path, stat
+
+    def record_play(self, track_id: str):
+        """
+        Считаем прослушивания в окне; трек, ставший популярным, уходит в очередь на скачивание.
+        """
+        now = time.monotonic()
+        count, started = self._plays.get(track_id, (0, now))
+        if now - started > settings.audio_cache_hot_window:
+            count, started = 0, now
+        count += 1
+        self._plays[track_id] = (count, started)
+        if count >= settings.audio_cache_hot_threshold and track_id not in self._queued:
+            self._queued.add(track_id)
+            self._plays.pop(track_id, None)
+            self.queue.put_nowait(track_id)
+        if len(self._plays) > 100000:
+            # Не даем счетчикам расти бесконечно
+            self._plays = {k: v for k, v in self._plays.items() if now - v[1] <= settings.audio_cache_hot_window}
+
+    # --- Запись ---
+
+    async def _add(self, path: Path, size: int):
+        key = str(path)
+        if key in self._index:
+            self.total_bytes -= self._index[key]
+        self._index[key] = size
+        self._index.move_to_end(key)
+        self.total_bytes += size
+        await self._evict()
+
+    async def _evict(self):
+        victims = []
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            old_key, old_size = self._index.popitem(last=False)
+            self.total_bytes -= old_size
+            victims.append(old_key)
+        if victims:
+            await asyncio.to_thread(self._remove, victims)
+
+    @staticmethod
+    def _remove(paths: List[str]):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    async def _worker(self):
+        while True:
+            track_id = await self.queue.get()
+            try:
+                if not await asyncio.to_thread(self.path_for(track_id).is_file):
+                    await self.fetch(track_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Audio cache fetch error for %s: %s", track_id, e)
+            finally:
+                self._queued.discard(track_id)
+
+    async def fetch(self, track_id: str):
+        song = await vk_service.get_audio_url(track_id)
+        if not song or not song.url:
+            return
+        path = self.path_for(track_id)
+        await asyncio.to_thread(path.parent.mkdir, parents=True, exist_ok=True)
+        # Пишем во временный файл и атомарно переименовываем:
+        # читатели никогда не увидят недокачанный трек
+        tmp = path.with_name(f".{path.stem}.{uuid.uuid4().hex}.tmp")
+        try:
+            started = time.perf_counter()
+            if ".m3u8" in song.url:
+                await self._assemble_hls(song.url, tmp, song.user_agent)
+            else:
+                await self._download(song.url, tmp, song.user_agent)
+            await asyncio.to_thread(os.replace, tmp, path)
+        finally:
+            await asyncio.to_thread(tmp.unlink, missing_ok=True)
+        size = (await asyncio.to_thread(path.stat)).st_size
+        self._index[str(path)] = size
+        self._index.move_to_end(str(path))
+        await self._sync_disk()
+        logger.info("Cached %s (%.1f MB, %.1f s)", track_id, size / 2**20, time.perf_counter() - started)
+
+    async def _sync_disk(self):
+        """
+        Каталог общий для всех воркеров, а лимит по байтам - один на всех:
+        сверяем индекс с диском (чужие файлы добавляем, удаленные забываем)
+        и только потом вытесняем лишнее.
+        """
+        files = await asyncio.to_thread(self._list_files)
+        on_disk = {str(path): size for _, path, size in files}
+        for key in [key for key in self._index if key not in on_disk]:
+            del self._index[key]
+        for key, size in on_disk.items():
+            # Новые для нас файлы встают в конец LRU: их только что скачал другой воркер
+            self._index[key] = size
+        self.total_bytes = sum(self._index.values())
+        await self._evict()
+
+    async def _get_bytes(self, url: str, user_agent: Optional[str] = None) -> bytes:
+        headers = {"User-Agent": user_agent or settings.vk_user_agent}
+        async with http.session.get(url, headers=headers, timeout=request_timeout()) as resp:
+            resp.raise_for_status()
+            return await resp.read()
+
+    async def _download(self, url: str, target: Path, user_agent: Optional[str] = None):
+        headers = {"User-Agent": user_agent or settings.vk_user_agent}
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=settings.http_connect_timeout,
+            sock_read=settings.http_read_timeout,
+        )
+        async with http.session.get(url, headers=headers, timeout=timeout) as resp:
+            resp.raise_for_status()
+            # Файлы по несколько МБ: open/write/close не должны блокировать event loop
+            f = await asyncio.to_thread(open, target, "wb")
+            try:
+                buffer = bytearray()
+                async for chunk in resp.content.iter_chunked(1 << 16):
+                    buffer += chunk
+                    if len(buffer) >= WRITE_BUFFER:
+                        data, buffer = buffer, bytearray()
+                        await asyncio.to_thread(f.write, data)
+                if buffer:
+                    await asyncio.to_thread(f.write, buffer)
+            finally:
+                await asyncio.to_thread(f.close)
+
+    async def _assemble_hls(self, url: str, target: Path, user_agent: Optional[str] = None):
+        if shutil.which("ffmpeg") is None:
+            raise HLSError("ffmpeg is required to assemble HLS tracks")
+
+        playlist = (await self._get_bytes(url, user_agent)).decode()
+        segments, variant = parse_playlist(playlist, url)
+        if variant:
+            playlist = (await self._get_bytes(variant, user_agent)).decode()
+            segments, _ = parse_playlist(playlist, variant)
+        if not segments:
+            raise HLSError("Empty HLS playlist")
+
+        keys: Dict[str, asyncio.Task] = {}
+        limit = asyncio.Semaphore(settings.audio_cache_segment_concurrency)
+
+        async def load(segment_url: str, key: Optional[dict], sequence: int) -> bytes:
+            async with limit:
+                data = await self._get_bytes(segment_url, user_agent)
+            if key is None:
+                return data
+            if key.get('METHOD') != 'AES-128':
+                raise HLSError(f"Unsupported HLS encryption: {key.get('METHOD')}")
+            key_uri = key['URI']
+            if key_uri not in keys:
+                keys[key_uri] = asyncio.ensure_future(self._get_bytes(key_uri, user_agent))
+            key_bytes = await keys[key_uri]
+            iv = bytes.fromhex(key['IV'][2:]) if 'IV' in key else sequence.to_bytes(16, 'big')
+            return decrypt_segment(data, key_bytes, iv)
+
+        parts = await asyncio.gather(*(load(*segment) for segment in segments))
+
+        # Сегменты - это MPEG-TS; склеиваем и перепаковываем в MP3
+        ts_path = target.with_suffix(".ts")
+        try:
+            await asyncio.to_thread(ts_path.write_bytes, b"".join(parts))
+            try:
+                # Обычно внутри уже MP3 - хватает смены контейнера
+                await self._ffmpeg(ts_path, target, "-c", "copy")
+            except HLSError:
+                await self._ffmpeg(ts_path, target, "-c:a", "libmp3lame", "-b:a", "192k")
+        finally:
+            if ts_path.exists():
+                ts_path.unlink()
+
+    async def _ffmpeg(self, source: Path, target: Path, *codec: str):
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y",
+            "-i", str(source), "-map", "0:a", *codec, "-f", "mp3", str(target),
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise HLSError(f"ffmpeg failed: {stderr.decode(errors='ignore').strip()}")
+
+
+audio_cache = AudioCache(settings.audio_cache_dir, settings.audio_cache_max_bytes)
@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, List, Optional
+from app.core.config import settings
+from app.core.database import db
+from app.core.metrics import CACHE_REQUESTS
+
+try:
+    import msgpack
+except ImportError:  # нужен только для общего уровня кэша
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """
+    Нормализация запроса для ключа кэша: регистр и лишние пробелы не важны.
+    """
+    return " ".join(query.lower().split())
+
+
+class TTLCache:
+    """
+    In-process LRU кэш с временем жизни записей. Протухшие записи еще
+    stale_ttl секунд доступны через get_stale (на случай недоступности источника).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, stale_ttl: float = 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._data: "OrderedDict[str, tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            if expires_at + self.stale_ttl <= now:
+                del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get_stale(self, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """
+        Значение, даже протухшее, но не дольше max_age (по умолчанию stale_ttl) после истечения.
+        """
+        max_age = self.stale_ttl if max_age is None else max_age
+        entry = self._data.get(key)
+        if entry is None or entry[0] + max_age <= time.monotonic():
+            return None
+        return entry[1]
+
+    def expires_in(self, key: str) -> Optional[float]:
+        """
+        Сколько секунд записи осталось жить (отрицательное - уже протухла).
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        return entry[0] - time.monotonic()
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            # Сначала выбрасываем протухшие, потом самые давние по LRU
+            self.prune()
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def prune(self):
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._data.items() if expires_at + self.stale_ttl <= now]:
+            del self._data[key]
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+def pack(value: Any) -> bytes:
+    """
+    Компактная сериализация значений для общего уровня (msgpack).
+    """
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+class MongoCacheTier:
+    """
+    Общий кэш в MongoDB: все воркеры uvicorn видят результаты друг друга.
+    Значения хранятся в msgpack, просроченные документы удаляет TTL-индекс по полю expires_at.
+    """
+
+    def __init__(self, collection: str):
+        if msgpack is None:
+            # Создается и напрямую (устаревший SEARCH_CACHE_SHARED)
+            raise RuntimeError("msgpack is required for the shared cache tier")
+        self.collection_name = collection
+        self._index_ready = False
+
+    @property
+    def collection(self):
+        return db.music_db[self.collection_name]
+
+    async def _ensure_index(self):
+        if self._index_ready:
+            return
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+        self._index_ready = True
+
+    async def get(self, key: str) -> Optional[Any]:
+        doc = await self.collection.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.utcnow()}}
+        )
+        if doc is None or not isinstance(doc.get("value"), bytes):
+            # Записи старого формата (без msgpack) считаем промахом
+            return None
+        return unpack(doc["value"])
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self._ensure_index()
+        await self.collection.update_one(
+            {"_id": key},
+            {"$set": {"value": pack(value), "expires_at": datetime.utcnow() + timedelta(seconds=ttl)}},
+            upsert=True,
+        )
+
+    async def delete(self, key: str):
+        await self.collection.delete_one({"_id": key})
+
+    async def close(self):
+        pass
+
+
+class RedisCacheTier:
+    """
+    Общий кэш в Redis (или любом сервере с протоколом RESP): один на все хосты.
+    Время жизни задается самим Redis (PX), значения в msgpack.
+    """
+
+    def __init__(self, url: str, namespace: str):
+        # redis - опциональная зависимость, нужна только для CACHE_SHARED_BACKEND=redis
+        import redis.asyncio as redis
+
+        self.client = redis.from_url(url)
+        self.prefix = f"{settings.cache_key_prefix}{namespace}:"
+
+    async def get(self, key: str) -> Optional[Any]:
+        data = await self.client.get(self.prefix + key)
+        return unpack(data) if data is not None else None
+
+    async def set(self, key: str, value: Any, ttl: float):
+        await self.client.set(self.prefix + key, pack(value), px=max(1, int(ttl * 1000)))
+
+    async def delete(self, key: str):
+        await self.client.delete(self.prefix + key)
+
+    async def close(self):
+        await self.client.aclose()
+
+
+# Созданные общие уровни (закрываются при остановке приложения)
+shared_tiers: List[Any] = []
+
+
+def build_shared_tier(namespace: str):
+    """
+    Общий уровень по настройке CACHE_SHARED_BACKEND: mongo, redis или ничего.
+    """
+    backend = settings.cache_shared_backend.lower()
+    if not backend:
+        return None
+    if msgpack is None:
+        raise RuntimeError("msgpack is required for the shared cache tier")
+    if backend == "mongo":
+        tier = MongoCacheTier(namespace)
+    elif backend == "redis":
+        tier = RedisCacheTier(settings.redis_url, namespace)
+    else:
+        raise ValueError(f"Unknown cache backend: {settings.cache_shared_backend}")
+    shared_tiers.append(tier)
+    return tier
+
+
+async def close_shared_tiers():
+    for tier in shared_tiers:
+        try:
+            await tier.close()
+        except Exception as e:
+            logger.warning("Shared cache close error: %s", e)
+
+
+class CoalescingCache:
+    """
+    Кэш перед медленным источником: локальный LRU, опциональный общий уровень
+    и склейка одновременных промахов по одному ключу в один запрос наверх.
+    Запись, протухшая не более swr_ttl секунд назад, отдается сразу,
+    а обновляется в фоне (stale-while-revalidate).
+    """
+
+    def __init__(
+        self,
+        name: str,
+        local: TTLCache,
+        shared=None,
+        swr_ttl: float = 0,
+        ttl_for: Optional[Callable[[Any], float]] = None,
+        dump: Optional[Callable[[Any], Any]] = None,
+        load: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.name = name
+        self.local = local
+        # Общий уровень: MongoCacheTier, RedisCacheTier или None
+        self.shared = shared
+        self.swr_ttl = swr_ttl
+        # Время жизни по самому значению (например, до expires ссылки)
+        self.ttl_for = ttl_for
+        # Преобразование значения в простые типы для общего уровня и обратно
+        self.dump = dump
+        self.load = load
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.local.get(key)
+        if value is not None:
+            CACHE_REQUESTS.inc(cache=self.name, result="hit")
+            return value
+
+        if self.swr_ttl:
+            stale = self.local.get_stale(key, self.swr_ttl)
+            if stale is not None:
+                CACHE_REQUESTS.inc(cache=self.name, result="stale")
+                self.refresh(key, fetch)
+                return stale
+
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        return await asyncio.shield(self._start(key, fetch))
+
+    def refresh(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """
+        Обновить запись из источника в фоне (мимо общего уровня).
+        """
+        return self._start(key, fetch, refresh=True)
+
+    def prefetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Optional[asyncio.Task]:
+        """
+        Загрузить запись в фоне, если её еще нет локально (например, соседнюю страницу).
+        """
+        if self.local.get(key) is not None:
+            return None
+        return self._start(key, fetch)
+
+    def _start(self, key: str, fetch: Callable[[], Awaitable[Any]], refresh: bool = False) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            # Промах идет наверх отдельной задачей: отмена одного клиента
+            # не должна ронять запрос для остальных, кто ждет тот же ключ
+            task = asyncio.ensure_future(self._load(key, fetch, refresh))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        return task
+
+    def _on_done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Забираем исключение, чтобы не было "exception was never retrieved"
+            task.exception()
+
+    def delete(self, key: str):
+        """
+        Забыть запись во всех уровнях (общий уровень чистится в фоне).
+        """
+        self.local.delete(key)
+        if self.shared is not None:
+            asyncio.ensure_future(self._delete_shared(key))
+
+    async def _delete_shared(self, key: str):
+        try:
+            await self.shared.delete(key)
+        except Exception as e:
+            logger.warning("Shared cache delete error: %s", e)
+
+    def _ttl(self, value: Any) -> float:
+        return self.ttl_for(value) if self.ttl_for is not None else self.local.ttl
+
+    async def _load(self, key: str, fetch: Callable[[], Awaitable[Any]], refresh: bool = False) -> Any:
+        if self.shared is not None and not refresh:
+            try:
+                value = await self.shared.get(key)
+            except Exception as e:
+                logger.warning("Shared cache read error: %s", e)
+                value = None
+            if value is not None:
+                if self.load is not None:
+                    value = self.load(value)
+                self.local.set(key, value, self._ttl(value))
+                return value
+
+        try:
+            value = await fetch()
+        except Exception:
+            # Источник недоступен - лучше устаревший результат, чем никакого
+            stale = self.local.get_stale(key)
+            if stale is None:
+                raise
+            logger.warning("Serving stale cache entry: %s", key)
+            return stale
+
+        ttl = self._ttl(value) if value is not None else 0
+        if ttl <= 0:
+            # Нет значения или ссылка, которая вот-вот протухнет, - не кэшируем
+            return value
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, self.dump(value) if self.dump is not None else value, ttl)
+            except Exception as e:
+                logger.warning("Shared cache write error: %s", e)
+        return value
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.core.http import http, request_timeout
+from app.core.metrics import CACHE_REQUESTS
+from app.services.cache import TTLCache
+from app.services.thumbnails import make_thumbnails
+from app.services.vk import vk_service
+
+logger = logging.getLogger(__name__)
+
+# Размер 0 - исходная обложка как есть (если Pillow не установлен)
+ORIGINAL = 0
+
+
+class CoverCache:
+    """
+    Превью обложек на диске: исходная картинка VK скачивается один раз,
+    все размеры сразу строятся в пуле процессов (не блокируя event loop),
+    файлы вытесняются LRU по суммарному объему.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, sizes: List[int]):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.resize = importlib.util.find_spec("PIL") is not None
+        self.sizes = sorted(sizes) if self.resize else [ORIGINAL]
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        # Ссылки на обложки из результатов поиска - чтобы не ходить в VK
+        self.cover_urls = TTLCache(settings.cover_url_cache_size, settings.cover_url_cache_ttl)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def pick_size(self, size: int) -> int:
+        # Ближайший готовый размер не меньше запрошенного
+        for candidate in self.sizes:
+            if candidate >= size:
+                return candidate
+        return self.sizes[-1]
+
+    def path_for(self, track_id: str, size: int) -> Path:
+        digest = hashlib.sha256(track_id.encode()).hexdigest()
+        return self.directory / digest[:2] / f"{digest}_{size}.jpg"
+
+    @staticmethod
+    def etag(path: Path) -> str:
+        stat = path.stat()
+        return f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+
+    def observe_tracks(self, tracks: Iterable[dict]):
+        for track in tracks:
+            if track.get("cover_url"):
+                self.cover_urls.set(track["id"], track["cover_url"])
+
+    # --- Жизненный цикл ---
+
+    async def start(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self._scan)
+        if self.resize:
+            # spawn: дочерние процессы не наследуют event loop и потоки приложения
+            self._pool = ProcessPoolExecutor(
+                max_workers=settings.cover_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        else:
+            logger.warning("Pillow is not installed, covers are served without resizing")
+        logger.info("Cover cache: %d files, %.1f MB", len(self._index), self.total_bytes / 2**20)
+
+    async def stop(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _scan(self):
+        files = []
+        for path in self.directory.glob("*/*.jpg"):
+            stat = path.stat()
+            files.append((stat.st_atime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._index[str(path)] = size
+            self.total_bytes += size
+
+    # --- Чтение ---
+
+    async def get(self, track_id: str, size: int) -> Optional[Path]:
+        path = self.path_for(track_id, self.pick_size(size))
+        key = str(path)
+        if path.is_file():
+            if key in self._index:
+                self._index.move_to_end(key)
+            else:
+                # Файл записал другой воркер
+                self._add(path)
+            CACHE_REQUESTS.inc(cache="cover", result="hit")
+            return path
+        if key in self._index:
+            self.total_bytes -= self._index.pop(key)
+
+        CACHE_REQUESTS.inc(cache="cover", result="miss")
+        # Одновременные запросы разных размеров одной обложки - одна загрузка
+        future = self._inflight.get(track_id)
+        if future is None:
+            future = asyncio.ensure_future(self._build(track_id))
+            self._inflight[track_id] = future
+            future.add_done_callback(lambda f: self._on_done(track_id, f))
+        await asyncio.shield(future)
+        return path if path.is_file() else None
+
+    def _on_done(self, track_id: str, future: asyncio.Future):
+        self._inflight.pop(track_id, None)
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("Cover build error for %s: %r", track_id, future.exception())
+
+    # --- Запись ---
+
+    async def _build(self, track_id: str):
+        url = self.cover_urls.get(track_id)
+        if url is None:
+            song = await vk_service.get_audio_url(track_id)
+            url = song.cover_url if song else None
+        if not url:
+            return
+
+        headers = {"User-Agent": settings.vk_user_agent}
+        async with http.session.get(url, headers=headers, timeout=request_timeout()) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+
+        if self._pool is not None:
+            loop = asyncio.get_running_loop()
+            images = await loop.run_in_executor(
+                self._pool, make_thumbnails, data, self.sizes, settings.cover_quality
+            )
+        else:
+            images = {ORIGINAL: data}
+
+        for size, image in images.items():
+            path = self.path_for(track_id, size)
+            await asyncio.to_thread(self._write, path, image)
+            self._add(path)
+
+    @staticmethod
+    def _write(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Атомарная подмена: читатели не увидят недописанный файл
+        tmp = path.with_name(f".{path.stem}.{uuid.uuid4().hex}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+
+    def _add(self, path: Path):
+        size = path.stat().st_size
+        key = str(path)
+        if key in self._index:
+            self.total_bytes -= self._index[key]
+        self._index[key] = size
+        self._index.move_to_end(key)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            old_key, old_size = self._index.popitem(last=False)
+            self.total_bytes -= old_size
+            try:
+                os.unlink(old_key)
+            except FileNotFoundError:
+                pass
+
+
+cover_cache = CoverCache(
+    settings.cover_cache_dir,
+    settings.cover_cache_max_bytes,
+    [int(size) for size in settings.cover_sizes.split(",") if size.strip()],
+)
+vk_service.track_listeners.append(cover_cache.observe_tracks)
@@ -0,0 +1,216 @@
+import asyncio
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+from app.core.config import settings
+from app.core.database import db
+from app.services.cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+def artist_key(artist: str) -> str:
+    # В именах артистов бывают "." и "$" - ключом поля служит хэш
+    return hashlib.md5(normalize_query(artist).encode()).hexdigest()[:16]
+
+
+def summary_updates(batch: List[dict]) -> List[UpdateOne]:
+    """
+    Инкременты сводки history_summary для пачки событий: одна операция на пользователя.
+    """
+    updates: Dict[int, dict] = {}
+    for doc in batch:
+        user_id = doc["user_id"]
+        listened_at = doc["listened_at"]
+        update = updates.get(user_id)
+        if update is None:
+            update = updates[user_id] = {
+                "$inc": {"plays": 0},
+                "$min": {"first_played": listened_at},
+                "$max": {"last_played": listened_at},
+                "$set": {},
+                "$setOnInsert": {"user_id": user_id},
+            }
+        update["$inc"]["plays"] += 1
+        update["$min"]["first_played"] = min(update["$min"]["first_played"], listened_at)
+        update["$max"]["last_played"] = max(update["$max"]["last_played"], listened_at)
+
+        artist = doc.get("artist") or "Unknown"
+        key = artist_key(artist)
+        update["$inc"][f"artists.{key}.plays"] = update["$inc"].get(f"artists.{key}.plays", 0) + 1
+        update["$set"][f"artists.{key}.name"] = artist
+
+    return [UpdateOne({"_id": user_id}, update, upsert=True) for user_id, update in updates.items()]
+
+
+def last_track_updates(batch: List[dict]) -> List[UpdateOne]:
+    """
+    Последний трек из пачки - только если она новее сохраненного. Выполняется
+    после summary_updates: last_played к этому моменту уже max(старое, новое),
+    поэтому совпадение значит, что в сводке нет прослушиваний новее этой пачки
+    (импорт офлайн-истории за январь не затрет вчерашний трек).
+    """
+    latest: Dict[int, dict] = {}
+    for doc in batch:
+        current = latest.get(doc["user_id"])
+        if current is None or doc["listened_at"] >= current["listened_at"]:
+            latest[doc["user_id"]] = doc
+    return [
+        UpdateOne(
+            # BSON хранит время с точностью до миллисекунд
+            {"_id": user_id, "last_played": doc["listened_at"].replace(microsecond=doc["listened_at"].microsecond // 1000 * 1000)},
+            {"$set": {"last_track": {
+                "track_id": doc["track_id"],
+                "title": doc.get("title", ""),
+                "artist": doc.get("artist", "Unknown"),
+            }}},
+        )
+        for user_id, doc in latest.items()
+    ]
+
+
+class HistoryWriter:
+    """
+    Write-behind буфер истории прослушиваний: события копятся в очереди
+    и пишутся в MongoDB пачками через insert_many(ordered=False) - по размеру
+    пачки или по возрасту первого события в ней. Если Mongo тормозит,
+    очередь заполняется и add() начинает ждать (backpressure).
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Подписчики на записанные пачки (профили рекомендаций и т.п.)
+        self.listeners: List[Callable[[List[dict]], None]] = []
+
+    async def add(self, doc: dict):
+        await self.queue.put(doc)
+
+    async def start(self):
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Останавливаемся, дописав в базу все, что осталось в очереди.
+        """
+        self._stopping = True
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self):
+        while not (self._stopping and self.queue.empty()):
+            batch = await self._collect()
+            if batch:
+                await self._flush(batch)
+
+    async def _collect(self) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        try:
+            first = await asyncio.wait_for(self.queue.get(), self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0 or self._stopping:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def write_batch(self, docs: List[dict]) -> bool:
+        """
+        Записать пачку сразу, мимо очереди (пакетный импорт от клиента).
+        """
+        return await self._flush(docs)
+
+    async def _insert(self, batch: List[dict]) -> Optional[List[dict]]:
+        """
+        insert_many с повтором только при сетевых ошибках. Возвращает события,
+        которых раньше не было в базе, или None, если пачку записать не удалось.
+        """
+        # Дубли с первой попытки записаны раньше (клиент повторил пакет).
+        # После сетевой ошибки дубль может быть и нашим, поэтому события
+        # с заданным клиентом _id (импорт) проверяем заранее
+        preset = [doc["_id"] for doc in batch if "_id" in doc]
+        stored = set()
+        if preset:
+            try:
+                cursor = db.music_db.history.find({"_id": {"$in": preset}}, {"_id": 1})
+                stored = {doc["_id"] for doc in await cursor.to_list(length=len(preset))}
+            except Exception as e:
+                logger.error("History flush error (%d docs): %s", len(batch), e)
+                return None
+
+        existing = set()
+        for attempt in range(3):
+            try:
+                await db.music_db.history.insert_many(batch, ordered=False)
+                break
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if e.details.get("writeConcernErrors") or any(error.get("code") != DUPLICATE_KEY for error in errors):
+                    logger.error("History flush error (%d docs): %s", len(batch), e.details)
+                    return None
+                # pymongo проставляет _id в документах, поэтому повтор после
+                # неоднозначной ошибки натыкается на уже записанные - это успех
+                existing = {
+                    error["index"] for error in errors
+                    if attempt == 0 or batch[error["index"]]["_id"] in stored
+                }
+                break
+            except ConnectionFailure as e:
+                logger.error("History flush error (%d docs, attempt %d): %s", len(batch), attempt + 1, e)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+            except Exception as e:
+                # Остальные ошибки повтором не лечатся
+                logger.error("History flush error (%d docs): %s", len(batch), e)
+                return None
+        else:
+            logger.error("Dropped %d history docs", len(batch))
+            return None
+        return [doc for i, doc in enumerate(batch) if i not in existing]
+
+    async def _flush(self, batch: List[dict]) -> bool:
+        written = await self._insert(batch)
+        if written is None:
+            return False
+        if not written:
+            return True
+
+        # Сводка по пользователям обновляется инкрементально, чтобы
+        # /history/{user_id}/summary читал один документ без агрегаций
+        try:
+            await db.music_db.history_summary.bulk_write(summary_updates(written), ordered=False)
+            await db.music_db.history_summary.bulk_write(last_track_updates(written), ordered=False)
+        except Exception as e:
+            logger.error("History summary update error (%d docs): %s", len(written), e)
+
+        for listener in self.listeners:
+            try:
+                listener(written)
+            except Exception as e:
+                logger.exception("History listener error: %s", e)
+        return True
+
+
+history_writer = HistoryWriter(
+    batch_size=settings.history_batch_size,
+    flush_interval=settings.history_flush_interval,
+    max_pending=settings.history_max_pending,
+)
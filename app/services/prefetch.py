@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from app.core.config import settings
+from app.services.cache import normalize_query
+from app.services.vk import vk_service
+
+logger = logging.getLogger(__name__)
+
+# Запрос, которым /recommendations отвечает без параметров - греем всегда
+PINNED_QUERIES = [("Top 100", 20)]
+
+
+class TopK:
+    """
+    Счетчики самых частых ключей по алгоритму Space-Saving:
+    память O(capacity), при вытеснении новый ключ наследует счетчик минимального.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.counts: Dict[Tuple[str, int], float] = {}
+
+    def observe(self, key: Tuple[str, int]):
+        if key in self.counts:
+            self.counts[key] += 1
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = 1
+        else:
+            victim = min(self.counts, key=self.counts.get)
+            self.counts[key] = self.counts.pop(victim) + 1
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        return sorted(self.counts, key=self.counts.get, reverse=True)[:n]
+
+    def decay(self, factor: float = 0.5):
+        # Старая популярность постепенно забывается
+        self.counts = {k: v * factor for k, v in self.counts.items() if v * factor >= 0.5}
+
+
+class SearchPrefetcher:
+    """
+    Фоновое обновление популярных запросов: до того как запись в кэше
+    протухнет, она обновляется из VK, и пользователи всегда читают теплые данные.
+    """
+
+    def __init__(self):
+        self.top = TopK(settings.prefetch_top_k * 4)
+        self._task: Optional[asyncio.Task] = None
+
+    def observe(self, query: str, limit: int):
+        self.top.observe((normalize_query(query), limit))
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh_due()
+            except Exception as e:
+                logger.exception("Prefetch error: %s", e)
+            self.top.decay()
+            await asyncio.sleep(settings.prefetch_interval)
+
+    async def refresh_due(self):
+        keys = PINNED_QUERIES + self.top.top(settings.prefetch_top_k)
+        # Обновляем то, что протухнет до следующего прохода (или еще не загружено)
+        horizon = settings.prefetch_interval + settings.prefetch_margin
+        due = []
+        for query, limit in dict.fromkeys(keys):
+            expires_in = vk_service.search_cache.local.expires_in(vk_service.search_key(query, limit))
+            if expires_in is None or expires_in < horizon:
+                due.append((query, limit))
+
+        limit_concurrency = asyncio.Semaphore(settings.prefetch_concurrency)
+
+        async def refresh(query: str, limit: int):
+            async with limit_concurrency:
+                await vk_service.refresh_search(query, limit)
+
+        await asyncio.gather(*(refresh(q, l) for q, l in due), return_exceptions=True)
+
+
+prefetcher = SearchPrefetcher()
+vk_service.query_listeners.append(prefetcher.observe)
@@ -0,0 +1,125 @@
+import time
+import weakref
+from typing import Optional
+import aiohttp
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.core.http import http
+from app.core.metrics import registry
+
+# Заголовки ответа CDN, которые пробрасываем клиенту (нужны для перемотки)
+PASSTHROUGH_HEADERS = (
+    "Content-Type",
+    "Content-Length",
+    "Content-Range",
+    "Accept-Ranges",
+    "ETag",
+    "Last-Modified",
+)
+
+STREAM_TTFB = registry.histogram(
+    "audio_proxy_ttfb_seconds", "Time to first byte from the CDN for proxied streams"
+)
+STREAM_THROUGHPUT = registry.histogram(
+    "audio_proxy_throughput_bytes_per_second",
+    "Average throughput of finished proxied streams",
+    buckets=(32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 5e6, 10e6, 50e6),
+)
+STREAM_BYTES = registry.counter("audio_proxy_bytes_total", "Bytes streamed through the audio proxy")
+STREAM_REJECTED = registry.counter("audio_proxy_rejected_total", "Proxied streams rejected by the concurrency cap")
+
+
+
+class StreamLimiter:
+    """
+    Ограничение числа одновременных проксируемых стримов (без очереди:
+    лишние запросы сразу получают 503).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+
+    def acquire(self):
+        if self.active >= self.limit:
+            STREAM_REJECTED.inc()
+            raise HTTPException(
+                status_code=503,
+                detail="Too many proxied streams, try again later",
+                headers={"Retry-After": "5"},
+            )
+        self.active += 1
+
+    def release(self):
+        self.active -= 1
+
+
+active_streams = StreamLimiter(settings.proxy_max_streams)
+
+
+class UpstreamForbidden(Exception):
+    """
+    CDN ответил 403 - ссылка протухла или привязана к другому клиенту.
+    """
+
+
+async def open_stream(url: str, range_header: Optional[str], user_agent: Optional[str] = None) -> aiohttp.ClientResponse:
+    # Ссылку запрашиваем тем же клиентом, что её получил
+    headers = {"User-Agent": user_agent or settings.vk_user_agent}
+    if range_header:
+        headers["Range"] = range_header
+    # Длинный стрим не ограничиваем общим таймаутом - только на подключение и паузы чтения
+    timeout = aiohttp.ClientTimeout(
+        total=None,
+        connect=settings.http_connect_timeout,
+        sock_read=settings.http_read_timeout,
+    )
+    resp = await http.session.get(url, headers=headers, timeout=timeout)
+    if resp.status == 403:
+        resp.release()
+        raise UpstreamForbidden(url)
+    if resp.status not in (200, 206):
+        resp.release()
+        raise HTTPException(status_code=502, detail=f"CDN responded with {resp.status}")
+    return resp
+
+
+def stream_response(resp: aiohttp.ClientResponse, started: float) -> StreamingResponse:
+    """
+    Отдаем тело ответа CDN кусками по мере поступления, без буферизации файла.
+    Слот стрима освобождается, когда клиент дочитал или отвалился.
+    """
+
+    state = {"done": False}
+
+    def finish(sent: int = 0):
+        # Вызывается ровно один раз: из генератора или при его сборке мусора,
+        # если клиент отвалился до начала передачи тела
+        if state["done"]:
+            return
+        state["done"] = True
+        resp.release()
+        active_streams.release()
+        elapsed = time.perf_counter() - started
+        STREAM_BYTES.inc(sent)
+        if sent and elapsed > 0:
+            STREAM_THROUGHPUT.observe(sent / elapsed)
+
+    async def body():
+        sent = 0
+        try:
+            async for chunk in resp.content.iter_chunked(settings.proxy_chunk_size):
+                if sent == 0:
+                    STREAM_TTFB.observe(time.perf_counter() - started)
+                sent += len(chunk)
+                yield chunk
+        finally:
+            finish(sent)
+
+    iterator = body()
+    weakref.finalize(iterator, finish)
+
+    headers = {name: resp.headers[name] for name in PASSTHROUGH_HEADERS if name in resp.headers}
+    headers.setdefault("Accept-Ranges", "bytes")
+    return StreamingResponse(iterator, status_code=resp.status, headers=headers)
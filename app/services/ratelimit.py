@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:  # Windows: состояние только внутри процесса
+    fcntl = None
+
+STATE = struct.Struct("dd")  # tokens, updated_at
+
+
+class RateLimitQueueFull(Exception):
+    pass
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    Token bucket под лимиты VK на токен. Если задан path, состояние ведра
+    хранится в файле под flock, и все воркеры uvicorn на хосте делят один
+    бюджет. Запросы сверх бюджета ждут своей очереди (FIFO), пока очередь
+    не заполнится.
+    """
+
+    def __init__(self, rate: float, burst: int, max_queue: int, path: Optional[str] = None):
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.path = path if fcntl is not None else None
+        self.waiting = 0
+        self._tokens = float(burst)
+        self._updated_at = time.time()
+        self._lock = asyncio.Lock()
+        self._fd: Optional[int] = None
+
+    async def acquire(self):
+        if self.waiting >= self.max_queue:
+            raise RateLimitQueueFull("VK request queue is full")
+        self.waiting += 1
+        try:
+            async with self._lock:
+                while True:
+                    wait = self._update(take=True)
+                    if wait <= 0:
+                        return
+                    await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+    def drain(self):
+        """
+        VK сказал "слишком много запросов" - обнуляем бюджет.
+        """
+        self._update(take=False, drain=True)
+
+    def _update(self, take: bool, drain: bool = False) -> float:
+        if self.path is None:
+            self._tokens, self._updated_at, wait = self._refill(self._tokens, self._updated_at, take, drain)
+            return wait
+
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            raw = os.pread(self._fd, STATE.size, 0)
+            tokens, updated_at = STATE.unpack(raw) if len(raw) == STATE.size else (float(self.burst), time.time())
+            tokens, updated_at, wait = self._refill(tokens, updated_at, take, drain)
+            os.pwrite(self._fd, STATE.pack(tokens, updated_at), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        return wait
+
+    def _refill(self, tokens: float, updated_at: float, take: bool, drain: bool):
+        now = time.time()
+        elapsed = max(0.0, now - updated_at)
+        tokens = min(float(self.burst), tokens + elapsed * self.rate)
+        if drain:
+            return 0.0, now, 0.0
+        if take and tokens >= 1:
+            return tokens - 1, now, 0.0
+        return tokens, now, (1 - tokens) / self.rate
+
+
+class CircuitBreaker:
+    """
+    После threshold ошибок подряд перестаем ходить в VK на reset_timeout секунд,
+    затем пропускаем один пробный запрос (half-open).
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def check(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._probe_in_flight):
+            raise CircuitOpenError("VK API circuit is open")
+        if state == "half-open":
+            self._probe_in_flight = True
+
+    def release_probe(self):
+        # Пробный запрос не дошел до VK (отмена, переполненная очередь)
+        self._probe_in_flight = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            if self.opened_at is None:
+                logger.warning("VK circuit opened after %d errors", self.failures)
+            self.opened_at = time.monotonic()
@@ -0,0 +1,305 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from datetime import timezone
+from typing import Dict, Iterable, List, Optional
+from app.core.config import settings
+from app.core.database import db
+from app.services.cache import normalize_query
+from app.services.history import history_writer
+from app.services.vk import vk_service
+
+# "Forward decay": вес события растет со временем от точки отсчета, поэтому
+# старые события не пересчитываются на каждом шаге. Когда показатель степени
+# доходит до MAX_DECAY_EXPONENT (2**64 - далеко от предела float), точка
+# отсчета сдвигается, а накопленные веса масштабируются одним проходом
+MAX_DECAY_EXPONENT = 64.0
+
+RECENT_TRACKS = 50  # последние треки в профиле (исключаются из выдачи)
+PROFILE_ARTISTS = 200
+PROFILE_TRACKS = 500
+TRACKS_PER_ARTIST = 50  # кандидатов на артиста в пуле
+NEIGHBOURS = 50  # соседей на трек в индексе встречаемости
+COOCCURRENCE_WINDOW = 3  # сколько предыдущих треков считаем "слушали подряд"
+SEED_TRACKS = 10
+SEED_ARTISTS = 10
+
+
+def make_track(track_id: str, title: str, artist: str) -> dict:
+    return {
+        "id": track_id,
+        "title": title,
+        "artist": artist,
+        "duration": 0,
+        "cover_url": None,
+        # Обложки в истории нет, но /cover сам найдет её через audio.getById
+        "thumb_url": f"/api/music/cover/{track_id}?size=96",
+        "url_api": f"/api/music/download/{track_id}",
+    }
+
+
+def _trim(counter: Dict[str, float], size: int):
+    # При переполнении оставляем 80% самых весомых ключей,
+    # чтобы не сортировать заново на каждом добавлении
+    if len(counter) > size:
+        keep = int(size * 0.8)
+        for key in sorted(counter, key=counter.get)[: len(counter) - keep]:
+            del counter[key]
+
+
+class UserProfile:
+    """
+    Вектор предпочтений пользователя: веса артистов и треков
+    с экспоненциальным затуханием + последние прослушанные треки.
+    """
+
+    def __init__(self):
+        self.artists: Dict[str, float] = {}
+        self.tracks: Dict[str, float] = {}
+        self.recent: deque = deque(maxlen=RECENT_TRACKS)
+        self.loaded_at = time.monotonic()
+
+    def add(self, track_id: str, artist: str, weight: float):
+        artist = normalize_query(artist)
+        if artist and artist != "unknown":
+            self.artists[artist] = self.artists.get(artist, 0.0) + weight
+            _trim(self.artists, PROFILE_ARTISTS)
+        self.tracks[track_id] = self.tracks.get(track_id, 0.0) + weight
+        _trim(self.tracks, PROFILE_TRACKS)
+        if track_id in self.recent:
+            self.recent.remove(track_id)
+        self.recent.append(track_id)
+
+
+class RecommendationEngine:
+    """
+    Рекомендации по истории прослушиваний без обращения к VK на горячем пути:
+    - профиль пользователя (аффинити к артистам/трекам), LRU по пользователям;
+    - индекс совместной встречаемости треков (слушали подряд);
+    - пул кандидатов: треки из результатов поиска, сгруппированные по артистам.
+    Все структуры обновляются инкрементально по мере записи истории.
+    """
+
+    def __init__(self):
+        self.profiles: "OrderedDict[int, UserProfile]" = OrderedDict()
+        self.cooccurrence: "OrderedDict[str, Dict[str, float]]" = OrderedDict()
+        self.catalog: "OrderedDict[str, dict]" = OrderedDict()
+        self.artist_tracks: "OrderedDict[str, OrderedDict]" = OrderedDict()
+        # Последние треки каждого пользователя для построения пар "слушали подряд"
+        self._sessions: "OrderedDict[int, deque]" = OrderedDict()
+        self._loading: Dict[int, asyncio.Task] = {}
+        self.decay_epoch = time.time()
+
+    # --- Наполнение ---
+
+    def observe_tracks(self, tracks: Iterable[dict]):
+        for track in tracks:
+            self._remember_track(track)
+
+    def observe_history(self, docs: Iterable[dict]):
+        for doc in docs:
+            user_id = doc.get("user_id")
+            track_id = doc.get("track_id")
+            if user_id is None or not track_id:
+                continue
+            artist = doc.get("artist") or ""
+            if track_id not in self.catalog:
+                self._remember_track(make_track(track_id, doc.get("title") or "", artist))
+
+            weight = self._weight(doc.get("listened_at"))
+            self._link(user_id, track_id, weight)
+            # Профиль обновляем, только если он уже загружен целиком
+            profile = self.profiles.get(user_id)
+            if profile is not None:
+                profile.add(track_id, artist, weight)
+
+    def _remember_track(self, track: dict):
+        track_id = track["id"]
+        known = self.catalog.get(track_id)
+        # Не затираем полные данные из поиска урезанными из истории
+        if known is None or track.get("duration"):
+            self.catalog[track_id] = track
+        self.catalog.move_to_end(track_id)
+        while len(self.catalog) > settings.rec_catalog_size:
+            self.catalog.popitem(last=False)
+
+        artist = normalize_query(track.get("artist") or "")
+        if not artist:
+            return
+        pool = self.artist_tracks.get(artist)
+        if pool is None:
+            pool = self.artist_tracks[artist] = OrderedDict()
+        pool[track_id] = None
+        pool.move_to_end(track_id)
+        while len(pool) > TRACKS_PER_ARTIST:
+            pool.popitem(last=False)
+        self.artist_tracks.move_to_end(artist)
+        while len(self.artist_tracks) > settings.rec_catalog_size // 10:
+            self.artist_tracks.popitem(last=False)
+
+    def _link(self, user_id: int, track_id: str, weight: float):
+        session = self._sessions.get(user_id)
+        if session is None:
+            session = self._sessions[user_id] = deque(maxlen=COOCCURRENCE_WINDOW)
+        self._sessions.move_to_end(user_id)
+        while len(self._sessions) > settings.rec_max_profiles:
+            self._sessions.popitem(last=False)
+
+        for previous in session:
+            if previous != track_id:
+                self._bump(previous, track_id, weight)
+                self._bump(track_id, previous, weight)
+        session.append(track_id)
+
+    def _bump(self, a: str, b: str, weight: float):
+        neighbours = self.cooccurrence.get(a)
+        if neighbours is None:
+            neighbours = self.cooccurrence[a] = {}
+        neighbours[b] = neighbours.get(b, 0.0) + weight
+        _trim(neighbours, NEIGHBOURS)
+        self.cooccurrence.move_to_end(a)
+        while len(self.cooccurrence) > settings.rec_catalog_size:
+            self.cooccurrence.popitem(last=False)
+
+    @staticmethod
+    def _timestamp(listened_at) -> float:
+        if listened_at is None:
+            return time.time()
+        # MongoDB отдает наивные datetime в UTC
+        if listened_at.tzinfo is None:
+            listened_at = listened_at.replace(tzinfo=timezone.utc)
+        return listened_at.timestamp()
+
+    def _advance_epoch(self, ts: float):
+        half_life = settings.rec_half_life_days * 86400
+        if (ts - self.decay_epoch) / half_life > MAX_DECAY_EXPONENT:
+            self._rescale(ts, half_life)
+
+    def _weight(self, listened_at) -> float:
+        ts = self._timestamp(listened_at)
+        self._advance_epoch(ts)
+        # Очень старые события дают 0.0 (underflow), а не ошибку
+        return math.pow(2.0, (ts - self.decay_epoch) / (settings.rec_half_life_days * 86400))
+
+    def _rescale(self, epoch: float, half_life: float):
+        """
+        Сдвинуть точку отсчета затухания: все веса умножаются на один и тот же
+        множитель, поэтому относительный порядок и доли в rank() не меняются.
+        """
+        factor = math.pow(2.0, -(epoch - self.decay_epoch) / half_life)
+        self.decay_epoch = epoch
+        for profile in self.profiles.values():
+            for weights in (profile.artists, profile.tracks):
+                for key in weights:
+                    weights[key] *= factor
+        for neighbours in self.cooccurrence.values():
+            for key in neighbours:
+                neighbours[key] *= factor
+
+    # --- Профили ---
+
+    async def get_profile(self, user_id: int) -> Optional[UserProfile]:
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            self.profiles.move_to_end(user_id)
+            # Профиль мог устареть (историю пишут и другие воркеры) -
+            # отдаем текущий и обновляем в фоне
+            if time.monotonic() - profile.loaded_at > settings.rec_profile_ttl:
+                self._schedule_load(user_id)
+            return profile
+        return await self._schedule_load(user_id)
+
+    def _schedule_load(self, user_id: int) -> asyncio.Task:
+        task = self._loading.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load_profile(user_id))
+            self._loading[user_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+        return task
+
+    async def _load_profile(self, user_id: int) -> Optional[UserProfile]:
+        cursor = db.music_db.history.find(
+            {"user_id": user_id},
+            {"_id": 0, "track_id": 1, "title": 1, "artist": 1, "listened_at": 1},
+        ).sort("listened_at", -1).limit(settings.rec_history_window)
+        docs = await cursor.to_list(length=settings.rec_history_window)
+        if not docs:
+            return None
+
+        # Точку отсчета сдвигаем до сборки профиля: _rescale не знает
+        # о весах, которые еще не попали в self.profiles
+        self._advance_epoch(self._timestamp(docs[0].get("listened_at")))
+        profile = UserProfile()
+        for doc in reversed(docs):
+            if doc["track_id"] not in self.catalog:
+                self._remember_track(make_track(doc["track_id"], doc.get("title") or "", doc.get("artist") or ""))
+            profile.add(doc["track_id"], doc.get("artist") or "", self._weight(doc.get("listened_at")))
+
+        self.profiles[user_id] = profile
+        self.profiles.move_to_end(user_id)
+        while len(self.profiles) > settings.rec_max_profiles:
+            self.profiles.popitem(last=False)
+        return profile
+
+    # --- Выдача ---
+
+    async def recommend(self, user_id: int, limit: int) -> List[dict]:
+        profile = await self.get_profile(user_id)
+        if profile is None:
+            return []
+        return self.rank(profile, limit)
+
+    def rank(self, profile: UserProfile, limit: int) -> List[dict]:
+        scores: Dict[str, float] = {}
+
+        # 1. Соседи недавно прослушанных треков (свежие весят больше)
+        recent = list(profile.recent)[-SEED_TRACKS:]
+        for position, seed in enumerate(reversed(recent)):
+            neighbours = self.cooccurrence.get(seed)
+            if not neighbours:
+                continue
+            total = sum(neighbours.values())
+            seed_weight = 1.0 / (1 + position)
+            for track_id, value in neighbours.items():
+                scores[track_id] = scores.get(track_id, 0.0) + seed_weight * value / total
+
+        # 2. Треки любимых артистов из пула кандидатов
+        top_artists = sorted(profile.artists.items(), key=lambda kv: kv[1], reverse=True)[: SEED_ARTISTS]
+        artists_total = sum(value for _, value in top_artists) or 1.0
+        for artist, value in top_artists:
+            pool = self.artist_tracks.get(artist)
+            if not pool:
+                continue
+            affinity = 0.5 * value / artists_total
+            for rank, track_id in enumerate(reversed(pool)):
+                scores[track_id] = scores.get(track_id, 0.0) + affinity / (1 + 0.1 * rank)
+
+        # Не советуем то, что человек и так слушает
+        for track_id in profile.recent:
+            scores.pop(track_id, None)
+
+        result, seen = [], set()
+        for track_id in sorted(scores, key=scores.get, reverse=True):
+            track = self.catalog.get(track_id)
+            if track is None:
+                continue
+            # Дедупликация одинаковых песен, залитых разными людьми
+            signature = (normalize_query(track.get("artist") or ""), normalize_query(track.get("title") or ""))
+            if signature in seen:
+                continue
+            seen.add(signature)
+            result.append(track)
+            if len(result) >= limit:
+                break
+        return result
+
+    def top_artist(self, profile: UserProfile) -> Optional[str]:
+        if not profile.artists:
+            return None
+        return max(profile.artists, key=profile.artists.get)
+
+
+recommender = RecommendationEngine()
+vk_service.track_listeners.append(recommender.observe_tracks)
+history_writer.listeners.append(recommender.observe_history)
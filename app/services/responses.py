@@ -0,0 +1,142 @@
+import gzip
+import hashlib
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+from app.core.config import settings
+from app.core.metrics import CACHE_REQUESTS
+from app.services.cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # без brotli сжимаем только gzip
+    brotli = None
+
+
+@lru_cache(maxsize=256)
+def pick_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Лучшее из поддерживаемых сжатий по заголовку Accept-Encoding (с учетом q=0).
+    Значения заголовка у клиентов повторяются, поэтому разбор кэшируется.
+    """
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Слабое сравнение из If-None-Match: список тегов через запятую или "*".
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+class CachedBody:
+    """
+    Сериализованный ответ одной версии результата: тело, ETag по содержимому
+    (одинаковый во всех воркерах) и сжатые варианты, которые строятся по требованию.
+    """
+
+    __slots__ = ("source", "body", "etag", "encoded")
+
+    def __init__(self, source: Any, body: bytes):
+        self.source = source
+        self.body = body
+        # Слабый: один тег на все варианты сжатия
+        self.etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+        self.encoded: Dict[str, bytes] = {}
+
+    def encode(self, encoding: str) -> bytes:
+        data = self.encoded.get(encoding)
+        if data is None:
+            CACHE_REQUESTS.inc(cache="response_compressed", result="miss")
+            if encoding == "br":
+                data = brotli.compress(self.body, quality=settings.response_brotli_quality)
+            else:
+                data = gzip.compress(self.body, compresslevel=settings.response_gzip_level)
+            self.encoded[encoding] = data
+        else:
+            CACHE_REQUESTS.inc(cache="response_compressed", result="hit")
+        return data
+
+
+class ResponseCache:
+    """
+    Готовые ответы для повторяющихся запросов (Mini App перерисовывается
+    и шлет тот же /search). Версия результата - сам объект из кэша VKService:
+    пока он тот же, тело, ETag и сжатие не пересчитываются.
+    """
+
+    def __init__(self, maxsize: int):
+        # Дольше, чем живет результат в кэше поиска, запись все равно не пригодится
+        self.bodies = TTLCache(maxsize, settings.search_cache_ttl + settings.search_cache_stale_ttl)
+
+    def render(self, key: Optional[str], source: Any, payload: Any) -> CachedBody:
+        if key is not None:
+            entry = self.bodies.get(key)
+            if entry is not None and entry.source is source:
+                CACHE_REQUESTS.inc(cache="response", result="hit")
+                return entry
+            CACHE_REQUESTS.inc(cache="response", result="miss")
+        entry = CachedBody(source, orjson.dumps(payload))
+        if key is not None:
+            self.bodies.set(key, entry)
+        return entry
+
+    def respond(
+        self,
+        request: Request,
+        payload: Any,
+        key: Optional[str] = None,
+        source: Any = None,
+        max_age: Optional[float] = None,
+        private: bool = False,
+    ) -> Response:
+        """
+        JSON-ответ с ETag, Cache-Control по оставшемуся времени жизни результата,
+        304 на совпавший If-None-Match и сжатием больших тел.
+        Без key ответ не кэшируется (например, персональные рекомендации).
+        """
+        entry = self.render(key, source, payload)
+        scope = "private" if private else "public"
+        max_age = int(max_age or 0)
+        headers = {
+            "ETag": entry.etag,
+            "Cache-Control": f"{scope}, max-age={max_age}" if max_age > 0 else f"{scope}, no-cache",
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request.headers.get("if-none-match"), entry.etag):
+            return Response(status_code=304, headers=headers)
+
+        body = entry.body
+        accept_encoding = request.headers.get("accept-encoding")
+        if accept_encoding and len(body) >= settings.response_compress_min_bytes:
+            encoding = pick_encoding(accept_encoding)
+            if encoding is not None:
+                body = entry.encode(encoding)
+                headers["Content-Encoding"] = encoding
+        return Response(body, media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache(settings.response_cache_size)
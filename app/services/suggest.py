@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import logging
+import math
+import os
+import re
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Set
+import orjson
+from app.core.config import settings
+from app.services.history import history_writer
+from app.services.recommendations import make_track
+from app.services.vk import vk_service
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+
+
+def normalize_text(text: str) -> str:
+    # Регистр, ё/е и знаки препинания при подсказках не важны
+    return " ".join(PUNCTUATION_RE.sub(" ", text.lower().replace("ё", "е")).split())
+
+
+def grams(text: str) -> Set[str]:
+    """
+    Триграммы слов с пробелом в начале: " ма", "мак", "акс".
+    Конец слова не дополняем, поэтому недописанное слово совпадает по префиксу.
+    """
+    result = set()
+    for word in text.split():
+        padded = " " + word
+        if len(padded) < 3:
+            result.add(padded)
+        for i in range(len(padded) - 2):
+            result.add(padded[i:i + 3])
+    return result
+
+
+class SuggestIndex:
+    """
+    Локальный индекс названий и артистов для мгновенных подсказок:
+    инвертированный индекс по триграммам (префиксы и опечатки),
+    не больше max_tracks треков (вытесняются давно не встречавшиеся).
+    Наполняется результатами поиска и историей, в VK не ходит.
+    """
+
+    def __init__(self, max_tracks: int):
+        self.max_tracks = max_tracks
+        self.tracks: "OrderedDict[str, dict]" = OrderedDict()
+        self.texts: Dict[str, str] = {}
+        self.weights: Dict[str, float] = {}
+        self.postings: Dict[str, Set[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._loaded = False
+
+    # --- Наполнение ---
+
+    def add(self, track: dict, weight: float = 0.0):
+        track_id = track["id"]
+        if track_id in self.tracks:
+            # Не затираем полные данные из поиска урезанными из истории
+            if track.get("duration"):
+                self.tracks[track_id] = track
+            self.tracks.move_to_end(track_id)
+        else:
+            text = normalize_text(f"{track.get('artist') or ''} {track.get('title') or ''}")
+            if not text:
+                return
+            self.tracks[track_id] = track
+            self.texts[track_id] = " " + text
+            for gram in grams(text):
+                self.postings.setdefault(gram, set()).add(track_id)
+            while len(self.tracks) > self.max_tracks:
+                self._evict()
+        if weight:
+            self.weights[track_id] = self.weights.get(track_id, 0.0) + weight
+        self._dirty = True
+
+    def _evict(self):
+        track_id, _ = self.tracks.popitem(last=False)
+        self.weights.pop(track_id, None)
+        for gram in grams(self.texts.pop(track_id)):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(track_id)
+                if not posting:
+                    del self.postings[gram]
+
+    def observe_tracks(self, tracks: Iterable[dict]):
+        for track in tracks:
+            self.add(track)
+
+    def observe_history(self, docs: Iterable[dict]):
+        # Прослушивания поднимают трек в подсказках
+        for doc in docs:
+            track_id = doc.get("track_id")
+            if track_id:
+                self.add(make_track(track_id, doc.get("title") or "", doc.get("artist") or ""), weight=1.0)
+
+    # --- Выдача ---
+
+    def search(self, query: str, limit: int) -> List[dict]:
+        text = normalize_text(query)
+        if len(text) < 2:
+            return []
+        # Редкие триграммы первыми: по ним кандидатов меньше всего
+        query_grams = sorted(grams(text), key=lambda gram: len(self.postings.get(gram, ())))
+        # Сколько триграмм должно совпасть: остальные списываем на опечатки
+        need = max(1, math.ceil(len(query_grams) * settings.suggest_min_score))
+
+        # У подходящего трека обязательно есть хотя бы одна из
+        # len - need + 1 самых редких триграмм запроса
+        candidates: Set[str] = set()
+        budget = settings.suggest_max_candidates
+        for gram in query_grams[:len(query_grams) - need + 1]:
+            posting = self.postings.get(gram)
+            if posting:
+                candidates.update(islice(posting, budget - len(candidates)))
+                if len(candidates) >= budget:
+                    break
+
+        padded = " " + text
+        scored = []
+        for track_id in candidates:
+            # Триграммы слов - это подстроки " " + текст трека
+            track_text = self.texts[track_id]
+            count = sum(map(track_text.__contains__, query_grams))
+            if count < need:
+                continue
+            score = count / len(query_grams)
+            if padded in track_text:
+                score += 0.5
+            score += 0.1 * math.log1p(self.weights.get(track_id, 0.0))
+            scored.append((score, track_id))
+
+        result, seen = [], set()
+        for _, track_id in heapq.nlargest(limit * 2, scored):
+            # Одна и та же песня, залитая разными людьми
+            if self.texts[track_id] in seen:
+                continue
+            seen.add(self.texts[track_id])
+            result.append(self.tracks[track_id])
+            if len(result) >= limit:
+                break
+        return result
+
+    # --- Снимок на диске ---
+
+    async def start(self):
+        if settings.suggest_snapshot_path:
+            # Снимок грузим в фоне: сервер отвечает сразу, подсказки догружаются
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            # Недогруженный индекс не должен затереть полный снимок
+            if self._loaded:
+                await self.save()
+
+    async def _run(self):
+        await self.load()
+        self._loaded = True
+        while True:
+            await asyncio.sleep(settings.suggest_snapshot_interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logger.exception("Suggest snapshot error: %s", e)
+
+    async def load(self):
+        path = settings.suggest_snapshot_path
+        if not os.path.exists(path):
+            return
+
+        def read():
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+
+        try:
+            snapshot = await asyncio.to_thread(read)
+        except Exception as e:
+            logger.warning("Suggest snapshot is unreadable, starting cold: %s", e)
+            return
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return
+        for i, (track, weight) in enumerate(snapshot["tracks"], 1):
+            self.add(track, weight)
+            if i % 1000 == 0:
+                # Отдаем event loop запросам, пока индекс наполняется
+                await asyncio.sleep(0)
+        logger.info("Suggest index loaded: %d tracks", len(self.tracks))
+
+    async def save(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        # Список собираем на event loop (структуры меняются только здесь),
+        # а сериализацию и запись отдаем в поток
+        tracks = [[track, self.weights.get(track_id, 0.0)] for track_id, track in self.tracks.items()]
+        path = settings.suggest_snapshot_path
+
+        def write():
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # Несколько воркеров пишут один файл: пишем во временный и подменяем атомарно
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(orjson.dumps({"version": SNAPSHOT_VERSION, "tracks": tracks}))
+            os.replace(tmp, path)
+
+        await asyncio.to_thread(write)
+
+
+suggest_index = SuggestIndex(settings.suggest_max_tracks)
+vk_service.track_listeners.append(suggest_index.observe_tracks)
+history_writer.listeners.append(suggest_index.observe_history)
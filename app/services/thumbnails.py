@@ -0,0 +1,32 @@
+"""
+Ресайз обложек. Модуль выполняется в дочерних процессах пула,
+поэтому намеренно не импортирует ничего из приложения.
+"""
+import io
+from typing import Dict, Iterable
+
+
+def make_thumbnails(data: bytes, sizes: Iterable[int], quality: int) -> Dict[int, bytes]:
+    """
+    Квадратные JPEG-превью нужных размеров из исходной обложки.
+    """
+    # Pillow - опциональная зависимость, без нее отдаем исходную обложку
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("RGB", (max(sizes), max(sizes)))
+        image = image.convert("RGB")
+        # Обложки бывают не квадратными - обрезаем по центру
+        side = min(image.size)
+        left = (image.width - side) // 2
+        top = (image.height - side) // 2
+        image = image.crop((left, top, left + side, top + side))
+
+        result = {}
+        for size in sorted(sizes, reverse=True):
+            if size < image.width:
+                image = image.resize((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+            result[size] = buffer.getvalue()
+        return result
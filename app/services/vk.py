@@ -1,80 +1,407 @@
 import asyncio
-import aiohttp
-from vkpymusic import Service
+import importlib.util
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+import orjson
 from app.core.config import settings
+from app.core.http import http, request_timeout
+from app.core.logging import SAMPLED
+from app.core.metrics import THREADPOOL_WAIT, VK_LATENCY
+from app.services.batching import BatchResolver
+from app.services.cache import CoalescingCache, MongoCacheTier, TTLCache, build_shared_tier, normalize_query
+from app.services.accounts import VKAccount, build_account_pool
+from app.services.ratelimit import CircuitBreaker, CircuitOpenError, RateLimitQueueFull
+
+logger = logging.getLogger(__name__)
+
+AUTH_FAILED = 5
+TOO_MANY_REQUESTS = 6
+# Флуд-контроль и дневные лимиты: аккаунт надо убрать из ротации
+ACCOUNT_LIMIT_ERRORS = {9, 29}
+# Ошибки, говорящие о проблемах на стороне VK (а не о плохом запросе)
+TRANSIENT_ERRORS = {1, 10}
+# VK просит притормозить: vkpymusic ходит в тот же VK, запасной путь не поможет
+NO_FALLBACK_ERRORS = {TOO_MANY_REQUESTS, *ACCOUNT_LIMIT_ERRORS}
+
+class VKAPIError(Exception):
+    def __init__(self, error: dict):
+        self.error = error
+        self.code = error.get('error_code')
+        super().__init__(error.get('error_msg', str(error)))
+
+@dataclass
+class AudioInfo:
+    """
+    Данные трека из audio.getById (те же поля, что отдает vkpymusic.Song).
+    """
+    track_id: str
+    url: str
+    artist: str
+    title: str
+    duration: int = 0
+    cover_url: Optional[str] = None
+    # User-Agent аккаунта, получившего ссылку: CDN может привязать её к клиенту
+    user_agent: Optional[str] = None
+
+def extract_cover(item: dict) -> Optional[str]:
+    album = item.get('album', {})
+    thumb = album.get('thumb', {}) if album else {}
+    if thumb:
+        return thumb.get('photo_600') or thumb.get('photo_300') or thumb.get('photo_68')
+    return None
+
+def search_track(item: dict) -> dict:
+    """
+    Элемент audio.search сразу в форме схемы Track: роуты отдают его
+    без повторной валидации, поэтому типы полей гарантируем здесь.
+    """
+    track_id = f"{item['owner_id']}_{item['id']}"
+    cover_url = extract_cover(item)
+    return {
+        "id": track_id,
+        "title": item.get('title') or "",
+        "artist": item.get('artist') or "",
+        "duration": item.get('duration') or 0,
+        "cover_url": cover_url,
+        # Легкое превью для списков вместо photo_600
+        "thumb_url": f"/api/music/cover/{track_id}?size=96" if cover_url else None,
+        "url_api": f"/api/music/download/{track_id}"
+    }
+
+def audio_url_ttl(url: str) -> float:
+    """
+    Сколько можно хранить ссылку: до её expires минус запас,
+    либо настраиваемый TTL, если параметра нет.
+    """
+    expires = parse_qs(urlsplit(url).query).get('expires')
+    if expires:
+        try:
+            return float(expires[0]) - time.time() - settings.audio_url_expiry_margin
+        except ValueError:
+            pass
+    return settings.audio_url_cache_ttl
 
 class VKService:
     def __init__(self):
-        # Инициализируем библиотеку vkpymusic. 
-        # Используем наш "волшебный" User-Agent и Токен.
-        self.service = Service(settings.vk_user_agent, settings.vk_token)
+        # Пул токенов VK: у каждого свой бюджет запросов (общий для воркеров
+        # через файл) и свое здоровье
+        self.accounts = build_account_pool()
+        # Библиотека vkpymusic (запасной путь) создается при первом обращении:
+        # импорт тянет curl_cffi/requests и пишет логи на диск, а нужна она редко
+        self.fallback_available = importlib.util.find_spec("vkpymusic") is not None
+        self._service = None
+        self._service_lock = threading.Lock()
+        # Кэш результатов поиска (+ общий уровень для всех воркеров и хостов)
+        search_shared = build_shared_tier("search_cache")
+        if search_shared is None and settings.search_cache_shared:
+            # Старая настройка: общий уровень только для поиска, в MongoDB
+            search_shared = MongoCacheTier("search_cache")
+        self.search_cache = CoalescingCache(
+            "search",
+            TTLCache(settings.search_cache_size, settings.search_cache_ttl, settings.search_cache_stale_ttl),
+            search_shared,
+            swr_ttl=settings.search_cache_swr_ttl,
+            ttl_for=lambda tracks: settings.search_cache_ttl if tracks else settings.search_cache_empty_ttl,
+        )
+        # Circuit breaker на случай недоступности самого VK
+        self.breaker = CircuitBreaker(settings.vk_breaker_threshold, settings.vk_breaker_reset)
+        # Подписчики на свежие результаты поиска (рекомендации, индексы)
+        self.track_listeners: List[Callable[[List[dict]], None]] = []
+        # ... и на сами запросы (статистика популярности)
+        self.query_listeners: List[Callable[[str, int], None]] = []
+        # Уже разрешенные ссылки на аудио (живут до expires из URL);
+        # в общем уровне хранятся как dict - вместе с обложкой трека
+        self.url_cache = CoalescingCache(
+            "audio_url",
+            TTLCache(settings.audio_url_cache_size, settings.audio_url_cache_ttl),
+            build_shared_tier("audio_url_cache"),
+            ttl_for=lambda song: audio_url_ttl(song.url) if song.url else 0,
+            dump=asdict,
+            load=lambda data: AudioInfo(**data),
+        )
+        # Одновременные getById склеиваются в один вызов VK
+        self.audio_batcher = BatchResolver(
+            self._get_by_ids,
+            window=settings.vk_batch_window_ms / 1000,
+            max_batch=settings.vk_batch_max_ids,
+        )
+        # ... и запасные запросы через vkpymusic тоже: упавший батч не должен
+        # превращаться в N отдельных вызовов
+        self.fallback_batcher = BatchResolver(
+            self._get_by_ids_vkpymusic,
+            window=settings.vk_batch_window_ms / 1000,
+            max_batch=settings.vk_batch_max_ids,
+        )
 
-    async def search_tracks(self, query: str, limit: int = 20):
+    async def _call(self, method: str, params: dict) -> dict:
         """
-        Прямой поиск через API для получения обложек.
+        Вызов метода VK API через общий пул соединений, пул токенов и circuit breaker.
         """
-        async with aiohttp.ClientSession() as session:
-            params = {
-                'access_token': settings.vk_token,
-                'v': '5.131',
-                'q': query,
-                'count': limit,
-                'sort': 2, 
-                'auto_complete': 1
-            }
-            # Честно прикидываемся официальным клиентом
-            headers = {
-                'User-Agent': settings.vk_user_agent
-            }
-            
-            try:
-                async with session.get('https://api.vk.com/method/audio.search', params=params, headers=headers) as resp:
-                    data = await resp.json()
-            except Exception as e:
-                print(f"VK API Connection Error: {e}")
-                return []
+        _, data = await self._call_with_account(method, params)
+        return data
+
+    async def _call_with_account(self, method: str, params: dict) -> Tuple[VKAccount, dict]:
+        """
+        То же, что _call, плюс аккаунт, с которого ушел успешный запрос.
+        """
+        self.breaker.check()
+        try:
+            account = None
+            for attempt in range(2):
+                account = self.accounts.pick(exclude=account)
+                await account.limiter.acquire()
+                account.in_flight += 1
+                started = time.perf_counter()
+                try:
+                    data = await self._request(account, method, params)
+                except Exception:
+                    account.record_error("network")
+                    self.breaker.record_failure()
+                    raise
+                finally:
+                    account.in_flight -= 1
+                    account.record_call(time.perf_counter() - started)
+
+                error = data.get('error')
+                if error is None:
+                    self.breaker.record_success()
+                    return account, data
+
+                code = error.get('error_code')
+                account.record_error(code)
+                retry = attempt == 0
+                if code == AUTH_FAILED:
+                    account.disable(settings.vk_account_auth_cooldown, "auth")
+                elif code in ACCOUNT_LIMIT_ERRORS:
+                    account.disable(settings.vk_account_rate_cooldown, "rate_limit")
+                elif code == TOO_MANY_REQUESTS:
+                    # Бюджет кончился раньше, чем мы думали - обнуляем его
+                    # и повторяем (по возможности с другого аккаунта)
+                    account.limiter.drain()
+                else:
+                    retry = False
+                if retry:
+                    continue
 
-        if 'error' in data:
-            print(f"VK API Error: {data['error']}")
-            return []
+                if code in TRANSIENT_ERRORS or code == TOO_MANY_REQUESTS:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise VKAPIError(error)
+        finally:
+            # Пробный запрос мог не дойти до VK (отмена, переполненная очередь) -
+            # иначе breaker остался бы открытым навсегда
+            self.breaker.release_probe()
+
+    async def _request(self, account: VKAccount, method: str, params: dict) -> dict:
+        params = {
+            **params,
+            'access_token': account.token,
+            'v': settings.vk_api_version,
+        }
+        # Честно прикидываемся официальным клиентом
+        headers = {
+            'User-Agent': account.user_agent
+        }
+        started = time.perf_counter()
+        async with http.session.get(
+            f"{settings.vk_api_url}/{method}",
+            params=params,
+            headers=headers,
+            timeout=request_timeout(),
+        ) as resp:
+            body = await resp.read()
+        parsed = time.perf_counter()
+        VK_LATENCY.observe(parsed - started, method=method, stage="http")
+        data = orjson.loads(body)
+        VK_LATENCY.observe(time.perf_counter() - parsed, method=method, stage="parse")
+        return data
+
+    async def search_tracks(self, query: str, limit: int = 20, offset: int = 0):
+        """
+        Поиск треков с кэшем: одинаковые запросы в пределах TTL не идут в VK,
+        а одновременные промахи склеиваются в один запрос.
+        Каждая страница (offset) кэшируется отдельной записью.
+        """
+        if offset == 0:
+            # Популярность считаем по первым страницам - их и греет prefetcher
+            for listener in self.query_listeners:
+                listener(query, limit)
+        key = self.search_key(query, limit, offset)
+        try:
+            return await self.search_cache.get_or_fetch(key, lambda: self._search(query, limit, offset))
+        except VKAPIError as e:
+            logger.warning("VK API error: %s", e.error)
+        except Exception as e:
+            logger.warning("VK API connection error: %r", e)
+        return []
+
+    @staticmethod
+    def search_key(query: str, limit: int, offset: int = 0) -> str:
+        return f"search:{limit}:{offset}:{normalize_query(query)}"
+
+    def search_expires_in(self, query: str, limit: int, offset: int = 0) -> float:
+        """
+        Сколько секунд результат поиска еще свежий в локальном кэше (для Cache-Control).
+        """
+        return self.search_cache.local.expires_in(self.search_key(query, limit, offset)) or 0.0
+
+    async def refresh_search(self, query: str, limit: int):
+        """
+        Принудительно обновить результат поиска в кэше (для фонового прогрева).
+        """
+        key = self.search_key(query, limit)
+        await self.search_cache.refresh(key, lambda: self._search(query, limit))
+
+    def prefetch_search(self, query: str, limit: int, offset: int):
+        """
+        Загрузить страницу поиска в фоне, пока пользователь смотрит соседнюю.
+        Пропускаем, если настоящие запросы уже ждут бюджета VK: спекулятивный
+        запрос встал бы в ту же очередь перед ними.
+        """
+        if self.accounts.queued:
+            return
+        key = self.search_key(query, limit, offset)
+        self.search_cache.prefetch(key, lambda: self._search(query, limit, offset))
+
+    async def _search(self, query: str, limit: int, offset: int = 0):
+        """
+        Прямой поиск через API для получения обложек.
+        """
+        params = {
+            'q': query,
+            'count': limit,
+            'offset': offset,
+            'sort': 2,
+            'auto_complete': 1
+        }
+        data = await self._call('audio.search', params)
 
         items = data.get('response', {}).get('items', [])
         tracks = []
-        
+
+        # Треки без URL не пропускаем - ссылку получим в /download
         for item in items:
-            # Не пропускаем треки без URL в поиске, так как мы получим его в /download
-            # if not item.get('url'):
-            #    continue
-
-            # Извлекаем обложку
-            cover_url = None
-            album = item.get('album', {})
-            thumb = album.get('thumb', {}) if album else {}
-            if thumb:
-                cover_url = thumb.get('photo_600') or thumb.get('photo_300') or thumb.get('photo_68')
-
-            track_id = f"{item['owner_id']}_{item['id']}"
-            
-            tracks.append({
-                "id": track_id,
-                "title": item.get('title'),
-                "artist": item.get('artist'),
-                "duration": item.get('duration'),
-                "cover_url": cover_url,
-                "url_api": f"/api/music/download/{track_id}"
-            })
-            
-        print(f"✅ Found {len(tracks)} tracks for query: {query}")
+            tracks.append(search_track(item))
+
+        logger.info("Found %d tracks for query: %s", len(tracks), query, extra=SAMPLED)
+        for listener in self.track_listeners:
+            listener(tracks)
         return tracks
 
-    async def get_audio_url(self, track_id: str):
+    @property
+    def service(self):
+        """
+        Клиент vkpymusic. Вызывается из пула потоков, поэтому под блокировкой.
+        """
+        if self._service is None:
+            with self._service_lock:
+                if self._service is None:
+                    from vkpymusic import Service
+                    # Используем наш "волшебный" User-Agent и Токен.
+                    primary = self.accounts.primary
+                    self._service = Service(primary.user_agent, primary.token)
+        return self._service
+
+    async def get_audio_url(self, track_id: str) -> Optional[AudioInfo]:
         """
-        Получение ссылки на MP3 через vkpymusic (она умеет делать getById).
+        Получение ссылки на MP3: кэш (локальный и общий уровни), затем
+        audio.getById прямо на event loop.
+        """
+        return await self.url_cache.get_or_fetch(track_id, lambda: self._resolve_audio(track_id))
+
+    async def _resolve_audio(self, track_id: str) -> Optional[AudioInfo]:
         """
-        # vkpymusic принимает список ID
-        songs = await asyncio.to_thread(self.service.get_songs_by_id, [track_id])
-        if not songs:
+        audio.getById через батчер; при ошибке (если разрешено настройкой)
+        откатываемся на vkpymusic. Если VK недоступен или мы уперлись в лимиты
+        (открыт breaker, очередь полна, ошибки 6/9/29), запасной путь не пробуем.
+        """
+        try:
+            return await self.audio_batcher.resolve(track_id)
+        except (CircuitOpenError, RateLimitQueueFull) as e:
+            logger.warning("VK getById skipped: %r", e)
+            return None
+        except Exception as e:
+            logger.warning("VK getById error: %r", e)
+            if isinstance(e, VKAPIError) and e.code in NO_FALLBACK_ERRORS:
+                return None
+            if not settings.vk_fallback_vkpymusic or not self.fallback_available:
+                return None
+        try:
+            return await self.fallback_batcher.resolve(track_id)
+        except (CircuitOpenError, RateLimitQueueFull) as e:
+            logger.warning("vkpymusic fallback skipped: %r", e)
             return None
-        return songs[0]
+
+    def invalidate_audio_url(self, track_id: str):
+        """
+        Ссылка больше не работает (например, CDN ответил 403) - забываем её.
+        """
+        self.url_cache.delete(track_id)
+
+    async def get_audio_urls(self, track_ids: List[str]) -> Dict[str, Optional[AudioInfo]]:
+        """
+        Разрешение списка треков; все ID уходят в один батч audio.getById.
+        """
+        unique_ids = list(dict.fromkeys(track_ids))
+        songs = await asyncio.gather(*(self.get_audio_url(track_id) for track_id in unique_ids))
+        return dict(zip(unique_ids, songs))
+
+    async def _get_by_ids(self, track_ids: List[str]) -> Dict[str, AudioInfo]:
+        account, data = await self._call_with_account('audio.getById', {'audios': ','.join(track_ids)})
+        songs = {}
+        for item in data.get('response') or []:
+            song = AudioInfo(
+                track_id=f"{item['owner_id']}_{item['id']}",
+                url=item.get('url', ''),
+                artist=item.get('artist', ''),
+                title=item.get('title', ''),
+                duration=item.get('duration', 0),
+                cover_url=extract_cover(item),
+                user_agent=account.user_agent,
+            )
+            songs[song.track_id] = song
+        return songs
+
+    async def _get_by_ids_vkpymusic(self, track_ids: List[str]) -> Dict[str, AudioInfo]:
+        """
+        Старый путь через vkpymusic (синхронный, в пуле потоков).
+        Идет с основного токена, поэтому тратит его бюджет запросов и учитывается breaker'ом.
+        """
+        self.breaker.check()
+        try:
+            await self.accounts.primary.limiter.acquire()
+            submitted = time.perf_counter()
+
+            def get_songs():
+                THREADPOOL_WAIT.observe(time.perf_counter() - submitted, task="vkpymusic_get_by_id")
+                return self.service.get_songs_by_id(track_ids)
+
+            try:
+                found = await asyncio.to_thread(get_songs)
+            except Exception:
+                self.breaker.record_failure()
+                raise
+            self.breaker.record_success()
+        finally:
+            self.breaker.release_probe()
+
+        songs = {}
+        for song in found or []:
+            # Приводим к AudioInfo, чтобы значение можно было положить в общий кэш
+            info = AudioInfo(
+                track_id=f"{song.owner_id}_{song.track_id}",
+                url=getattr(song, 'url', '') or '',
+                artist=getattr(song, 'artist', '') or '',
+                title=getattr(song, 'title', '') or '',
+                duration=int(getattr(song, 'duration', 0) or 0),
+                user_agent=self.accounts.primary.user_agent,
+            )
+            songs[info.track_id] = info
+        return songs
 
 vk_service = VKService()
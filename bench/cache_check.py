@@ -0,0 +1,145 @@
+"""
+Проверка общего уровня кэша без внешних сервисов: MongoCacheTier на
+in-memory fake MongoDB и RedisCacheTier на локальной заглушке RESP.
+Для каждого уровня проверяется один и тот же контракт: сериализация
+(msgpack), время жизни, удаление и обмен значениями между "воркерами"
+(двумя CoalescingCache с разными локальными LRU).
+
+    python -m bench.cache_check
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from dataclasses import asdict
+
+# Обязательные настройки приложения, чтобы скрипт работал без .env
+for name, value in {
+    "BOT_TOKEN": "123456:check-token",
+    "VK_TOKEN": "check-vk-token",
+    "VK_USER_AGENT": "VKAndroidApp/5.52-4543",
+    "MONGO_URL": "mongodb://fake",
+    "DB_NAME": "cache_check",
+    "SSL_KEYFILE": "",
+    "SSL_CERTFILE": "",
+}.items():
+    os.environ.setdefault(name, value)
+
+import app.core.database as database
+from bench.fake_mongo import FakeMotorClient
+from bench.resp_stub import start_server
+from bench.vk_stub import make_item
+from app.services.cache import CoalescingCache, MongoCacheTier, RedisCacheTier, TTLCache, pack
+from app.services.vk import AudioInfo
+
+database.AsyncIOMotorClient = FakeMotorClient
+
+
+class Checker:
+    def __init__(self):
+        self.failed = 0
+
+    def check(self, tier_name: str, name: str, ok: bool, detail: str = ""):
+        status = "ok" if ok else "FAIL"
+        if not ok:
+            self.failed += 1
+        print(f"  [{status}] {tier_name}: {name}{' - ' + detail if detail else ''}")
+
+
+def sample_page() -> list:
+    items = [make_item(100000 + i, 456000000 + i, "check") for i in range(20)]
+    return [
+        {
+            "id": f"{item['owner_id']}_{item['id']}",
+            "title": item["title"],
+            "artist": item["artist"],
+            "duration": item["duration"],
+            "cover_url": item["album"]["thumb"]["photo_600"],
+            "thumb_url": None,
+            "url_api": f"/api/music/download/{item['owner_id']}_{item['id']}",
+        }
+        for item in items
+    ]
+
+
+async def check_tier(checker: Checker, tier_name: str, tier):
+    page = sample_page()
+    song = AudioInfo("1_2", "https://cdn.example/a.mp3?expires=4102444800", "Artist", "Title", 200, None)
+
+    await tier.set("page", page, 60)
+    checker.check(tier_name, "list of tracks round trip", await tier.get("page") == page)
+    await tier.set("song", asdict(song), 60)
+    checker.check(tier_name, "AudioInfo round trip", AudioInfo(**await tier.get("song")) == song)
+
+    await tier.set("short", page, 0.2)
+    await asyncio.sleep(0.4)
+    checker.check(tier_name, "entry expires", await tier.get("short") is None)
+
+    await tier.delete("page")
+    checker.check(tier_name, "delete", await tier.get("page") is None)
+
+    # Два "воркера": свои локальные LRU, общий уровень один
+    fetches = 0
+
+    async def fetch():
+        nonlocal fetches
+        fetches += 1
+        return page
+
+    first = CoalescingCache("check", TTLCache(100, 60), tier)
+    second = CoalescingCache("check", TTLCache(100, 60), tier)
+    await first.get_or_fetch("shared", fetch)
+    value = await second.get_or_fetch("shared", fetch)
+    checker.check(tier_name, "second worker reads the first worker's value", value == page and fetches == 1)
+
+    urls_a = CoalescingCache(
+        "check_url", TTLCache(100, 60), tier,
+        ttl_for=lambda s: 60, dump=asdict, load=lambda d: AudioInfo(**d),
+    )
+    urls_b = CoalescingCache(
+        "check_url", TTLCache(100, 60), tier,
+        ttl_for=lambda s: 60, dump=asdict, load=lambda d: AudioInfo(**d),
+    )
+
+    async def resolve():
+        return song
+
+    await urls_a.get_or_fetch("1_2", resolve)
+    value = await urls_b.get_or_fetch("1_2", lambda: None)
+    checker.check(tier_name, "dataclass values through dump/load", value == song)
+
+    urls_b.delete("1_2")
+    await asyncio.sleep(0.05)
+    checker.check(tier_name, "delete reaches the shared tier", await tier.get("1_2") is None)
+
+
+async def main_async(args) -> int:
+    checker = Checker()
+    page = sample_page()
+    print(f"20-track page: {len(json.dumps(page).encode())} bytes JSON, {len(pack(page))} bytes msgpack")
+
+    print("MongoCacheTier (in-memory fake MongoDB)")
+    await database.connect_to_mongo()
+    await check_tier(checker, "mongo", MongoCacheTier("cache_check"))
+
+    print("RedisCacheTier (local RESP stand-in)")
+    server, stub = await start_server(args.redis_port)
+    async with server:
+        tier = RedisCacheTier(f"redis://127.0.0.1:{args.redis_port}/0", "check")
+        await check_tier(checker, "redis", tier)
+        await tier.close()
+    print(f"RESP stand-in served {stub.commands} commands")
+
+    print("OK" if not checker.failed else f"{checker.failed} check(s) failed")
+    return 1 if checker.failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--redis-port", type=int, default=6390)
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+In-memory замена Motor для бенчмарков: поддерживает ровно те операции,
+которые использует приложение. Задержка на операцию настраивается,
+чтобы имитировать сетевой round trip до MongoDB.
+"""
+import asyncio
+import copy
+import itertools
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from pymongo.errors import BulkWriteError, OperationFailure
+
+_ids = itertools.count(1)
+
+
+def _get(doc: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def _set(doc: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    if isinstance(value, datetime):
+        # BSON хранит время с точностью до миллисекунд
+        value = value.replace(microsecond=value.microsecond // 1000 * 1000)
+    doc[parts[-1]] = value
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, cond in query.items():
+        value = _get(doc, key)
+        if isinstance(cond, dict) and any(k.startswith("$") for k in cond):
+            for op, arg in cond.items():
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op == "$gte" and not (value is not None and value >= arg):
+                    return False
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _apply_update(doc: dict, update: dict, inserting: bool):
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for key, value in fields.items():
+                _set(doc, key, copy.deepcopy(value))
+        elif op == "$inc":
+            for key, value in fields.items():
+                _set(doc, key, (_get(doc, key) or 0) + value)
+        elif op == "$max":
+            for key, value in fields.items():
+                current = _get(doc, key)
+                if current is None or value > current:
+                    _set(doc, key, value)
+        elif op == "$min":
+            for key, value in fields.items():
+                current = _get(doc, key)
+                if current is None or value < current:
+                    _set(doc, key, value)
+
+
+class UpdateResult:
+    def __init__(self, matched: int, modified: int, upserted_id=None):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.upserted_id = upserted_id
+
+
+class FakeCursor:
+    def __init__(self, docs: List[dict], latency: float):
+        self._docs = docs
+        self._latency = latency
+
+    def sort(self, key, direction=1):
+        self._docs.sort(key=lambda d: (_get(d, key) is None, _get(d, key)), reverse=direction < 0)
+        return self
+
+    def limit(self, n: int):
+        if n:
+            self._docs = self._docs[:n]
+        return self
+
+    async def to_list(self, length: Optional[int] = None):
+        await asyncio.sleep(self._latency)
+        return self._docs[:length] if length else list(self._docs)
+
+
+class FakeCollection:
+    def __init__(self, latency: float):
+        self.docs: List[dict] = []
+        self.indexes: Dict[str, dict] = {"_id_": {"key": [("_id", 1)]}}
+        self.latency = latency
+
+    async def _roundtrip(self):
+        await asyncio.sleep(self.latency)
+
+    async def create_index(self, *args, **kwargs):
+        await self._roundtrip()
+        return "index"
+
+    async def create_indexes(self, indexes, **kwargs):
+        await self._roundtrip()
+        names = []
+        for model in indexes:
+            spec = dict(model.document)
+            spec["key"] = list(spec["key"].items())
+            name = spec.pop("name")
+            if name in self.indexes and self.indexes[name] != spec:
+                # Как MongoDB: то же имя с другими опциями - ошибка
+                raise OperationFailure(f"Index with name: {name} already exists with different options", 85)
+            self.indexes[name] = spec
+            names.append(name)
+        return names
+
+    async def index_information(self):
+        await self._roundtrip()
+        return copy.deepcopy(self.indexes)
+
+    async def drop_index(self, name: str):
+        await self._roundtrip()
+        if self.indexes.pop(name, None) is None:
+            raise OperationFailure(f"index not found with name [{name}]", 27)
+
+    async def insert_one(self, doc: dict):
+        await self._roundtrip()
+        doc.setdefault("_id", next(_ids))
+        self.docs.append(copy.deepcopy(doc))
+
+    async def insert_many(self, docs: List[dict], ordered: bool = True):
+        await self._roundtrip()
+        # Как и pymongo, проставляем _id прямо в переданных документах
+        ids = {doc["_id"] for doc in self.docs}
+        errors, inserted = [], 0
+        for index, doc in enumerate(docs):
+            doc.setdefault("_id", next(_ids))
+            if doc["_id"] in ids:
+                errors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key error"})
+                if ordered:
+                    break
+                continue
+            ids.add(doc["_id"])
+            self.docs.append(copy.deepcopy(doc))
+            inserted += 1
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": inserted})
+
+    async def find_one(self, query: dict, projection: Optional[dict] = None):
+        await self._roundtrip()
+        for doc in self.docs:
+            if _matches(doc, query):
+                return copy.deepcopy(doc)
+        return None
+
+    def find(self, query: dict, projection: Optional[dict] = None) -> FakeCursor:
+        return FakeCursor([copy.deepcopy(d) for d in self.docs if _matches(d, query)], self.latency)
+
+    def _update(self, query: dict, update: dict, upsert: bool) -> UpdateResult:
+        for doc in self.docs:
+            if _matches(doc, query):
+                _apply_update(doc, update, inserting=False)
+                return UpdateResult(1, 1)
+        if not upsert:
+            return UpdateResult(0, 0)
+        doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+        doc.setdefault("_id", next(_ids))
+        _apply_update(doc, update, inserting=True)
+        self.docs.append(doc)
+        return UpdateResult(0, 0, doc["_id"])
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        await self._roundtrip()
+        return self._update(query, update, upsert)
+
+    async def delete_one(self, query: dict):
+        await self._roundtrip()
+        for i, doc in enumerate(self.docs):
+            if _matches(doc, query):
+                del self.docs[i]
+                return
+
+    async def bulk_write(self, requests: List[Any], ordered: bool = True):
+        await self._roundtrip()
+        for request in requests:
+            # pymongo.UpdateOne хранит аргументы в приватных полях
+            self._update(request._filter, request._doc, request._upsert)
+
+
+class FakeDatabase:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self.latency)
+        return self._collections[name]
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, command: str, value: Any = None, **kwargs):
+        await asyncio.sleep(self.latency)
+        if command == "collMod" and "index" in kwargs:
+            options = dict(kwargs["index"])
+            spec = self[value].indexes.get(options.pop("name"))
+            if spec is None:
+                raise OperationFailure("cannot find index", 27)
+            spec.update(options)
+            return {"ok": 1}
+        raise OperationFailure(f"no such command: '{command}'", 59)
+
+
+class FakeMotorClient:
+    """
+    Подменяет AsyncIOMotorClient: FakeMotorClient(url, **kwargs)[db_name].
+    """
+
+    latency = 0.001
+
+    def __init__(self, *args, **kwargs):
+        self._databases: Dict[str, FakeDatabase] = {}
+
+    def __getitem__(self, name: str) -> FakeDatabase:
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self.latency)
+        return self._databases[name]
+
+    def close(self):
+        pass
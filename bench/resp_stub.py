@@ -0,0 +1,117 @@
+"""
+Минимальный сервер с протоколом Redis в памяти: GET, SET (EX/PX),
+DEL, EXISTS, PING, HELLO и служебные команды клиента. Нужен, чтобы проверять
+общий уровень кэша без настоящего Redis.
+
+    python -m bench.resp_stub --port 6390
+"""
+import argparse
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class RESPStub:
+    def __init__(self):
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.commands = 0
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args: List[bytes], proto: int = 2) -> bytes:
+        self.commands += 1
+        command = args[0].upper()
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"GET":
+            value = self._get(args[1])
+            if value is None:
+                # В RESP3 пустое значение кодируется отдельным типом
+                return b"_\r\n" if proto == 3 else b"$-1\r\n"
+            return b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            expires_at = None
+            options = [a.upper() for a in args[3:]]
+            for i, option in enumerate(options[:-1]):
+                if option == b"EX":
+                    expires_at = time.monotonic() + int(args[4 + i])
+                elif option == b"PX":
+                    expires_at = time.monotonic() + int(args[4 + i]) / 1000
+            self.data[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if command in (b"DEL", b"EXISTS"):
+            found = [key for key in args[1:] if self._get(key) is not None]
+            if command == b"DEL":
+                for key in found:
+                    del self.data[key]
+            return b":%d\r\n" % len(found)
+        if command == b"HELLO":
+            # Современные клиенты начинают с HELLO 3 и ждут в ответ карту RESP3
+            proto = int(args[1]) if len(args) > 1 else proto
+            fields = [
+                (b"server", b"$5\r\nredis\r\n"),
+                (b"version", b"$5\r\n7.2.0\r\n"),
+                (b"proto", b":%d\r\n" % proto),
+                (b"id", b":1\r\n"),
+                (b"mode", b"$10\r\nstandalone\r\n"),
+                (b"role", b"$6\r\nmaster\r\n"),
+                (b"modules", b"*0\r\n"),
+            ]
+            head = b"%%%d\r\n" % len(fields) if proto == 3 else b"*%d\r\n" % (2 * len(fields))
+            return head + b"".join(b"$%d\r\n%s\r\n%s" % (len(k), k, v) for k, v in fields)
+        if command in (b"CLIENT", b"SELECT"):
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % command
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        proto = 2
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # Клиенты шлют команды массивом bulk-строк: *N, затем $len + данные
+                count = int(line[1:])
+                args = []
+                for _ in range(count):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                if args[0].upper() == b"HELLO" and len(args) > 1:
+                    proto = int(args[1])
+                writer.write(self.execute(args, proto))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def start_server(port: int, host: str = "127.0.0.1") -> Tuple[asyncio.AbstractServer, RESPStub]:
+    stub = RESPStub()
+    server = await asyncio.start_server(stub.handle, host, port)
+    return server, stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    async def run():
+        server, _ = await start_server(args.port)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Офлайн-бенчмарк API: поднимает заглушку VK и сервер с fake MongoDB,
+гоняет эндпоинты на заданных уровнях конкурентности и печатает
+пропускную способность и p50/p95/p99. Сеть не нужна.
+
+    python -m bench.run
+    python -m bench.run --scenarios search,download --concurrency 1,32,128 --duration 15
+    python -m bench.run --json results.json   # для сравнения между релизами
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+import aiohttp
+
+BOT_TOKEN = "123456:bench-token"
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sign_init_data(user_id: int) -> str:
+    user = json.dumps({"id": user_id, "first_name": "Bench", "username": f"bench_{user_id}"})
+    params = {"auth_date": str(int(time.time())), "query_id": f"q{user_id}", "user": user}
+    check_str = "\n".join(f"{k}={v}" for k, v in sorted(params.items()))
+    secret = hmac.new(b"WebAppData", BOT_TOKEN.encode(), hashlib.sha256).digest()
+    params["hash"] = hmac.new(secret, check_str.encode(), hashlib.sha256).hexdigest()
+    return urlencode(params)
+
+
+def percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Scenarios:
+    """
+    Каждый сценарий - корутина, делающая один запрос; возвращает True при успехе.
+    """
+
+    def __init__(self, base_url: str, distinct_queries: int, users: int):
+        self.base_url = base_url
+        self.queries = [f"query {i}" for i in range(distinct_queries)]
+        self.users = list(range(1, users + 1))
+        self.init_data = {u: sign_init_data(u) for u in self.users}
+        self.track_ids = [f"{random.randint(1, 10**6)}_{i}" for i in range(1000)]
+        # ETag последнего ответа по запросу - как у клиента с HTTP-кэшем
+        self.etags = {}
+
+    def _query(self) -> str:
+        # Перекос как в жизни: немногие запросы дают большую часть трафика
+        return self.queries[min(len(self.queries) - 1, int(random.paretovariate(1.2)) - 1)]
+
+    async def search(self, session: aiohttp.ClientSession) -> bool:
+        async with session.get(f"{self.base_url}/api/music/search", params={"q": self._query()}) as resp:
+            await resp.read()
+            return resp.status == 200
+
+    async def search_conditional(self, session: aiohttp.ClientSession) -> bool:
+        query = self._query()
+        headers = {"If-None-Match": self.etags[query]} if query in self.etags else {}
+        async with session.get(f"{self.base_url}/api/music/search", params={"q": query}, headers=headers) as resp:
+            await resp.read()
+            if "ETag" in resp.headers:
+                self.etags[query] = resp.headers["ETag"]
+            return resp.status in (200, 304)
+
+    async def download(self, session: aiohttp.ClientSession) -> bool:
+        track_id = random.choice(self.track_ids)
+        async with session.get(f"{self.base_url}/api/music/download/{track_id}", allow_redirects=False) as resp:
+            await resp.read()
+            return resp.status in (200, 307)
+
+    async def recommendations(self, session: aiohttp.ClientSession) -> bool:
+        params = {"user_id": random.choice(self.users)} if random.random() < 0.7 else {}
+        async with session.get(f"{self.base_url}/api/music/recommendations", params=params) as resp:
+            await resp.read()
+            return resp.status == 200
+
+    async def login(self, session: aiohttp.ClientSession) -> bool:
+        init_data = self.init_data[random.choice(self.users)]
+        async with session.post(f"{self.base_url}/api/auth/login", json={"initData": init_data}) as resp:
+            await resp.read()
+            return resp.status == 200
+
+    async def history(self, session: aiohttp.ClientSession) -> bool:
+        track_id = random.choice(self.track_ids)
+        payload = {
+            "user_id": random.choice(self.users),
+            "track_id": track_id,
+            "title": f"Track {track_id}",
+            "artist": f"Artist {hash(track_id) % 500}",
+        }
+        async with session.post(f"{self.base_url}/api/auth/history", json=payload) as resp:
+            await resp.read()
+            return resp.status == 200
+
+
+async def run_level(call, concurrency: int, duration: float) -> dict:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def worker():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    ok = await call(session)
+                except aiohttp.ClientError:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+    }
+
+
+async def wait_ready(url: str, timeout: float = 30.0, interval: float = 0.1):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(interval)
+    raise RuntimeError(f"{url} did not start in {timeout} s")
+
+
+def base_env() -> dict:
+    """
+    Окружение для запуска приложения без живых токенов и MongoDB.
+    """
+    return {
+        **os.environ,
+        "BOT_TOKEN": BOT_TOKEN,
+        "VK_TOKEN": "bench-vk-token",
+        "VK_USER_AGENT": "VKAndroidApp/5.52-4543",
+        "MONGO_URL": "mongodb://fake",
+        "DB_NAME": "bench",
+        "SSL_KEYFILE": "",
+        "SSL_CERTFILE": "",
+        "LOG_LEVEL": "WARNING",
+        "PYTHONPATH": ROOT,
+    }
+
+
+def start_processes(args) -> list:
+    state_dir = tempfile.mkdtemp(prefix="vk-bench-")
+    env = {
+        **base_env(),
+        "VK_API_URL": f"http://127.0.0.1:{args.vk_port}/method",
+        # Заглушка не ограничивает частоту - меряем сервер, а не лимитер
+        "VK_RATE_LIMIT": str(args.vk_rate_limit),
+        "VK_RATE_BURST": str(max(1, int(args.vk_rate_limit))),
+        "VK_QUEUE_SIZE": "100000",
+        "VK_RATE_LIMIT_DIR": state_dir,
+    }
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "bench.vk_stub", "--port", str(args.vk_port),
+         "--latency-ms", str(args.vk_latency_ms), "--error-rate", str(args.vk_error_rate),
+         "--padding", str(args.vk_padding)],
+        cwd=ROOT, env=env,
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bench.server", "--port", str(args.port),
+         "--mongo-latency-ms", str(args.mongo_latency_ms)],
+        cwd=ROOT, env=env,
+    )
+    return [stub, server]
+
+
+def print_table(results: dict):
+    print(f"{'scenario':<16}{'conc':>6}{'reqs':>9}{'err':>6}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for scenario, levels in results.items():
+        for r in levels:
+            print(
+                f"{scenario:<16}{r['concurrency']:>6}{r['requests']:>9}{r['errors']:>6}"
+                f"{r['rps']:>10.1f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+            )
+
+
+async def main_async(args):
+    processes = start_processes(args)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        await wait_ready(base_url + "/")
+        scenarios = Scenarios(base_url, args.distinct_queries, args.users)
+        results = {}
+        for name in args.scenarios.split(","):
+            call = getattr(scenarios, name.strip())
+            # Короткий прогрев: кэши, пулы соединений
+            await run_level(call, 4, min(1.0, args.duration))
+            results[name] = [await run_level(call, c, args.duration) for c in args.concurrency]
+        print_table(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2, default=str)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default="search,download,recommendations,login,history")
+    parser.add_argument("--concurrency", type=lambda s: [int(x) for x in s.split(",")], default=[1, 16, 64])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--distinct-queries", type=int, default=500)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--vk-port", type=int, default=8801)
+    parser.add_argument("--vk-latency-ms", type=float, default=40.0)
+    parser.add_argument("--vk-error-rate", type=float, default=0.0)
+    parser.add_argument("--vk-padding", type=int, default=0)
+    parser.add_argument("--vk-rate-limit", type=float, default=100000.0)
+    parser.add_argument("--mongo-latency-ms", type=float, default=1.0)
+    parser.add_argument("--json", help="write results to this file")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
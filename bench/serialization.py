@@ -0,0 +1,106 @@
+"""
+CPU на запрос для выдачи поиска: старый путь (dict -> валидация в Track
+через response_model -> jsonable_encoder -> json) против быстрого
+(готовые элементы -> ORJSONResponse). Плюс разбор ответа VK: json против orjson.
+
+Запросы гоняются через ASGI в одном процессе, без сети, поэтому разница
+целиком приходится на сериализацию.
+
+    python -m bench.serialization --items 20,50 --requests 3000
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+# Обязательные настройки приложения, чтобы скрипт работал без .env
+for name, value in {
+    "BOT_TOKEN": "123456:bench-token",
+    "VK_TOKEN": "bench-vk-token",
+    "VK_USER_AGENT": "VKAndroidApp/5.52-4543",
+    "MONGO_URL": "mongodb://fake",
+    "DB_NAME": "bench",
+    "SSL_KEYFILE": "",
+    "SSL_CERTFILE": "",
+}.items():
+    os.environ.setdefault(name, value)
+
+import httpx
+import orjson
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from app.models.schemas import SearchResponse
+from app.services.vk import search_track
+from bench.vk_stub import make_item
+
+
+def build_tracks(count: int, padding: int) -> tuple:
+    raw = [make_item(100000 + i, 456000000 + i, "bench", padding) for i in range(count)]
+    body = json.dumps({"response": {"count": count, "items": raw}}).encode()
+    # Ровно то, что кладет в кэш VKService._search
+    tracks = [search_track(item) for item in raw]
+    return body, tracks
+
+
+def build_app(tracks: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/legacy", response_model=SearchResponse)
+    async def legacy():
+        return {"items": tracks, "next_cursor": None}
+
+    @app.get("/fast", response_model=SearchResponse)
+    async def fast():
+        return ORJSONResponse({"items": tracks, "next_cursor": None})
+
+    return app
+
+
+async def cpu_per_request(app: FastAPI, path: str, requests: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for _ in range(50):
+            await client.get(path)
+        started = time.process_time()
+        for _ in range(requests):
+            resp = await client.get(path)
+            resp.raise_for_status()
+        return (time.process_time() - started) / requests
+
+
+def cpu_per_call(func, arg, calls: int) -> float:
+    started = time.process_time()
+    for _ in range(calls):
+        func(arg)
+    return (time.process_time() - started) / calls
+
+
+async def main_async(args):
+    print(f"{'items':>6}{'stage':>12}{'before us':>12}{'after us':>12}{'saved':>8}")
+    for count in args.items:
+        body, tracks = build_tracks(count, args.padding)
+        app = build_app(tracks)
+        # Одинаковый результат на обоих путях - иначе сравнение бессмысленно
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            assert (await client.get("/legacy")).json() == (await client.get("/fast")).json()
+
+        rows = [
+            ("parse", cpu_per_call(json.loads, body, args.requests), cpu_per_call(orjson.loads, body, args.requests)),
+            ("request", await cpu_per_request(app, "/legacy", args.requests), await cpu_per_request(app, "/fast", args.requests)),
+        ]
+        for stage, before, after in rows:
+            print(f"{count:>6}{stage:>12}{before * 1e6:>12.1f}{after * 1e6:>12.1f}{1 - after / before:>8.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=lambda s: [int(x) for x in s.split(",")], default=[20, 50])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--padding", type=int, default=0, help="extra bytes per VK item")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
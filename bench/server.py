@@ -0,0 +1,29 @@
+"""
+Запуск API для бенчмарков: MongoDB подменяется на in-memory fake,
+VK - на локальную заглушку (адрес берется из VK_API_URL).
+
+    VK_API_URL=http://127.0.0.1:8801/method python -m bench.server --port 8800
+"""
+import argparse
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--mongo-latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+
+    import app.core.database as database
+    from bench.fake_mongo import FakeMotorClient
+
+    FakeMotorClient.latency = args.mongo_latency_ms / 1000
+    database.AsyncIOMotorClient = FakeMotorClient
+
+    from app.main import app
+
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Профиль холодного старта: время импорта app.main по пакетам
+(python -X importtime) и время от запуска процесса до первого ответа.
+
+    python -m bench.startup
+    python -m bench.startup --runs 5 --target-ms 1500 --top 20
+"""
+import argparse
+import asyncio
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+from bench.run import ROOT, base_env, wait_ready
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_profile() -> list:
+    """
+    Строки -X importtime: (собственное время, с зависимостями, вложенность, модуль, кто импортировал).
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=ROOT, env=base_env(), capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            rows.append([int(match[1]), int(match[2]), len(match[3]) // 2, match[4], None])
+    # Вывод идет в порядке завершения импорта: родитель печатается после детей
+    parents = {}
+    for row in reversed(rows):
+        depth = row[2]
+        row[4] = parents.get(depth - 1)
+        parents[depth] = row[3]
+    return rows
+
+
+def print_import_profile(rows: list, top: int):
+    total = next((row[1] for row in rows if row[3] == "app.main"), sum(row[0] for row in rows))
+    print(f"import app.main: {total / 1000:.0f} ms")
+
+    packages = Counter()
+    for self_us, _, _, module, _ in rows:
+        packages[module.split(".")[0]] += self_us
+    print(f"\n{'package':<28}{'self ms':>10}")
+    for package, self_us in packages.most_common(top):
+        print(f"{package:<28}{self_us / 1000:>10.1f}")
+
+    # Сторонние модули, которые тянет наш код, - кандидаты на ленивый импорт
+    direct = [row for row in rows if row[4] and row[4].startswith("app") and not row[3].startswith("app")]
+    direct.sort(key=lambda row: row[1], reverse=True)
+    print(f"\n{'imported by app':<36}{'total ms':>10}  from")
+    for _, cumulative_us, _, module, parent in direct[:top]:
+        print(f"{module:<36}{cumulative_us / 1000:>10.1f}  {parent}")
+
+
+async def time_to_first_request(port: int) -> float:
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "bench.server", "--port", str(port)],
+        cwd=ROOT, env=base_env(),
+    )
+    try:
+        await wait_ready(f"http://127.0.0.1:{port}/", interval=0.01)
+        return time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--target-ms", type=float, default=1500.0, help="time-to-first-request budget")
+    args = parser.parse_args()
+
+    print_import_profile(import_profile(), args.top)
+
+    timings = [asyncio.run(time_to_first_request(args.port)) * 1000 for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"\ntime to first request: median {median:.0f} ms, min {min(timings):.0f} ms "
+          f"over {args.runs} runs (target {args.target_ms:.0f} ms)")
+    # Ненулевой код выхода - чтобы проверку можно было повесить на CI
+    sys.exit(0 if median <= args.target_ms else 1)
+
+
+if __name__ == "__main__":
+    main()
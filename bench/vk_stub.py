@@ -0,0 +1,87 @@
+"""
+Локальная замена VK API для бенчмарков: audio.search и audio.getById
+с настраиваемой задержкой, долей ошибок и размером ответа.
+
+    python -m bench.vk_stub --port 8801 --latency-ms 40 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import random
+import zlib
+from aiohttp import web
+
+
+def make_item(owner_id: int, audio_id: int, query: str = "", padding: int = 0) -> dict:
+    seed = zlib.crc32(f"{owner_id}_{audio_id}".encode())
+    item = {
+        "id": audio_id,
+        "owner_id": owner_id,
+        "artist": f"Artist {seed % 500}",
+        "title": f"{query.title() or 'Track'} {seed % 10000}",
+        "duration": 120 + seed % 240,
+        "url": f"http://127.0.0.1/cdn/{owner_id}_{audio_id}.mp3?expires=4102444800",
+        "album": {
+            "id": seed % 100000,
+            "title": f"Album {seed % 1000}",
+            "thumb": {
+                "photo_68": f"http://127.0.0.1/img/{seed}_68.jpg",
+                "photo_300": f"http://127.0.0.1/img/{seed}_300.jpg",
+                "photo_600": f"http://127.0.0.1/img/{seed}_600.jpg",
+            },
+        },
+    }
+    if padding:
+        # Лишние поля, как в настоящих ответах VK (ads, main_artists и т.п.)
+        item["padding"] = "x" * padding
+    return item
+
+
+def build_app(latency_ms: float, jitter_ms: float, error_rate: float, padding: int = 0) -> web.Application:
+    async def respond(payload: dict) -> web.Response:
+        delay = max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        if random.random() < error_rate:
+            payload = {"error": {"error_code": 10, "error_msg": "Internal server error"}}
+        return web.json_response(payload)
+
+    async def search(request: web.Request) -> web.Response:
+        query = request.query.get("q", "")
+        count = int(request.query.get("count", 20))
+        offset = int(request.query.get("offset", 0))
+        base = zlib.crc32(query.lower().encode()) % 1000000
+        items = [make_item(base + 1, offset + i + 1, query, padding) for i in range(count)]
+        return await respond({"response": {"count": 1000, "items": items}})
+
+    async def get_by_id(request: web.Request) -> web.Response:
+        items = []
+        for audio in request.query.get("audios", "").split(","):
+            owner_id, _, audio_id = audio.partition("_")
+            if owner_id and audio_id:
+                items.append(make_item(int(owner_id), int(audio_id), padding=padding))
+        return await respond({"response": items})
+
+    app = web.Application()
+    app.router.add_get("/method/audio.search", search)
+    app.router.add_get("/method/audio.getById", get_by_id)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--padding", type=int, default=0, help="extra bytes per item")
+    args = parser.parse_args()
+    web.run_app(
+        build_app(args.latency_ms, args.jitter_ms, args.error_rate, args.padding),
+        host="127.0.0.1",
+        port=args.port,
+        print=None,
+        access_log=None,
+    )
+
+
+if __name__ == "__main__":
+    main()